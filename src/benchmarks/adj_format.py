@@ -0,0 +1,90 @@
+# coding: utf-8
+"""
+CPU latency and memory of the adjacency modes / layouts / value dtypes used for propagation, over thread counts
+and graph sizes (leading fractions of the training interactions). Prints the fastest setting for the dataset.
+Run from ``src``:  python -m benchmarks.adj_format -d baby
+##########################
+"""
+import argparse
+import itertools
+from time import time
+
+import torch
+
+from utils.configurator import Config
+from utils.dataset import RecDataset
+from common.graph import ADJ_FORMATS, VALUE_DTYPES, PropagationMatrix, norm_bi_adj_arrays, transpose_arrays, \
+    norm_adj_arrays
+
+
+def propagate(mats, x, n_users):
+    """One propagation layer: ``A x`` with the full adjacency, ``[R x_i; R^T x_u]`` with the bipartite blocks.
+    """
+    if len(mats) == 1:
+        return mats[0].mm(x)
+    return torch.cat([mats[0].mm(x[n_users:]), mats[1].mm(x[:n_users])])
+
+
+def time_spmm(mats, x, n_users, repeat):
+    """Seconds per layer, forward and backward to the dense operand, after one warm-up call.
+    """
+    propagate(mats, x, n_users).sum().backward()
+    start = time()
+    for _ in range(repeat):
+        propagate(mats, x, n_users).sum().backward()
+    return (time() - start) / repeat
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', '-d', type=str, default='baby', help='name of datasets')
+    parser.add_argument('--threads', type=int, nargs='+', default=None, help='torch thread counts to try')
+    parser.add_argument('--fractions', type=float, nargs='+', default=[0.25, 0.5, 1.0],
+                        help='graph sizes, as leading fractions of the training interactions')
+    parser.add_argument('--modes', type=str, nargs='+', default=['full', 'bipartite'], help='adj_mode values to try')
+    parser.add_argument('--repeat', type=int, default=10, help='timed products per setting')
+    args, _ = parser.parse_known_args()
+
+    config = Config('BM3', args.dataset, {'use_gpu': False})
+    train_dataset = RecDataset(config).split()[0]
+    users = train_dataset.df[train_dataset.uid_field].values
+    items = train_dataset.df[train_dataset.iid_field].values
+    n_users, n_items = train_dataset.get_user_num(), train_dataset.get_item_num()
+    n_nodes = n_users + n_items
+    max_threads = torch.get_num_threads()
+    threads = args.threads or sorted({1, 2, 4, max_threads} & set(range(1, max_threads + 1)))
+    x = torch.randn(n_nodes, config['embedding_size'], requires_grad=True)
+
+    print('dataset: {}, nodes: {}, train interactions: {}'.format(args.dataset, n_nodes, len(users)))
+    print('{:>8} {:>10} {:>7} {:>9} {:>6} {:>9} {:>9} {:>10}'.format(
+        'fraction', 'nnz', 'threads', 'mode', 'format', 'values', 'size MB', 'ms/layer'))
+    best = {}
+    for fraction in args.fractions:
+        n = int(len(users) * fraction)
+        r_indices, r_values = norm_bi_adj_arrays(users[:n], items[:n], n_users, n_items)
+        t_indices, t_values = transpose_arrays(r_indices, r_values)
+        indices, values = norm_adj_arrays(users[:n], items[:n], n_users, n_items)
+        for n_threads in threads:
+            torch.set_num_threads(n_threads)
+            for mode, fmt, dtype in itertools.product(args.modes, ADJ_FORMATS, VALUE_DTYPES):
+                if mode == 'bipartite':
+                    mats = (PropagationMatrix(r_indices, r_values, (n_users, n_items), fmt, dtype),
+                            PropagationMatrix(t_indices, t_values, (n_items, n_users),
+                                              'csr' if fmt == 'coo' else fmt, dtype))
+                else:
+                    mats = (PropagationMatrix(indices, values, (n_nodes, n_nodes), fmt, dtype),)
+                cost = time_spmm(mats, x, n_users, args.repeat)
+                print('{:>8.2f} {:>10} {:>7} {:>9} {:>6} {:>9} {:>9.2f} {:>10.2f}'.format(
+                    fraction, len(values), n_threads, mode, fmt, dtype,
+                    sum(m.nbytes() for m in mats) / 1024.0 ** 2, cost * 1e3))
+                if (fraction, n_threads) not in best or cost < best[(fraction, n_threads)][0]:
+                    best[(fraction, n_threads)] = (cost, mode, fmt, dtype)
+    torch.set_num_threads(max_threads)
+
+    print('\nfastest per setting:')
+    for (fraction, n_threads), (cost, mode, fmt, dtype) in sorted(best.items()):
+        print('  fraction {:.2f}, {} threads: {} / {} / {} ({:.2f} ms)'.format(
+            fraction, n_threads, mode, fmt, dtype, cost * 1e3))
+    cost, mode, fmt, dtype = best[(max(args.fractions), max(threads))]
+    print('\nsuggested for configs/dataset/{}.yaml:\nadj_mode: \'{}\'\nadj_format: \'{}\'\n'
+          'adj_value_dtype: \'{}\''.format(args.dataset, mode, fmt, dtype))
@@ -0,0 +1,60 @@
+# coding: utf-8
+"""
+Throughput of the memory-mapped chunked adjacency against its chunk size, next to the in-memory adjacency.
+Run from ``src``:  python -m benchmarks.adj_mmap -d baby
+##########################
+"""
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import torch
+
+from utils.configurator import Config
+from utils.dataset import RecDataset
+from common.graph import PropagationMatrix, norm_adj_arrays, load_mmap_norm_adj
+from benchmarks.bench_utils import time_layers
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', '-d', type=str, default='baby', help='name of datasets')
+    parser.add_argument('--chunks', type=int, nargs='+', default=[1024, 4096, 16384, 65536, 262144],
+                        help='adj_chunk_rows values')
+    parser.add_argument('--layers', type=int, default=2, help='n_layers')
+    parser.add_argument('--repeat', type=int, default=5, help='timed propagations per setting')
+    args, _ = parser.parse_known_args()
+
+    config = Config('BM3', args.dataset, {'use_gpu': False})
+    train_dataset = RecDataset(config).split()[0]
+    users = train_dataset.df[train_dataset.uid_field].values
+    items = train_dataset.df[train_dataset.iid_field].values
+    n_users, n_items = train_dataset.get_user_num(), train_dataset.get_item_num()
+    n_nodes = n_users + n_items
+    x = torch.randn(n_nodes, config['embedding_size'], requires_grad=True)
+    indices, values = norm_adj_arrays(users, items, n_users, n_items)
+
+    print('dataset: {}, nodes: {}, nnz: {}, layers: {}'.format(args.dataset, n_nodes, len(values), args.layers))
+    print('{:>10} {:>12} {:>14} {:>12} {:>14} {:>12}'.format(
+        'adjacency', 'chunk rows', 'chunk MB max', 'f+b(ms)', 'Mnnz/s', 'max diff'))
+    reference = None
+    for fmt in ['coo', 'csr']:
+        adj = PropagationMatrix(indices, values, (n_nodes, n_nodes), fmt)
+        cost, out = time_layers(adj, x, args.layers, args.repeat)
+        reference = out if reference is None else reference
+        print('{:>10} {:>12} {:>14.2f} {:>12.2f} {:>14.1f} {:>12.2e}'.format(
+            fmt, '-', adj.nbytes() / 1024.0 ** 2, cost * 1e3, 2 * args.layers * len(values) / cost / 1e6,
+            float((out - reference).abs().max())))
+
+    cache_root = tempfile.mkdtemp(prefix='adj_mmap_')
+    for chunk_rows in args.chunks:
+        adj = load_mmap_norm_adj(users, items, n_users, n_items, cache_root, chunk_rows=chunk_rows)
+        starts = np.arange(0, n_nodes, chunk_rows)
+        # int64 offsets + int64 columns + float32 values of the largest chunk
+        chunk_nnz = int(np.max(adj.indptr[np.minimum(starts + chunk_rows, n_nodes)] - adj.indptr[starts]))
+        cost, out = time_layers(adj, x, args.layers, args.repeat)
+        print('{:>10} {:>12} {:>14.2f} {:>12.2f} {:>14.1f} {:>12.2e}'.format(
+            'mmap', chunk_rows, (chunk_nnz * 12 + min(chunk_rows, n_nodes) * 8) / 1024.0 ** 2, cost * 1e3,
+            2 * args.layers * len(values) / cost / 1e6, float((out - reference).abs().max())))
+    shutil.rmtree(cache_root, ignore_errors=True)
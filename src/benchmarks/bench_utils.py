@@ -0,0 +1,109 @@
+# coding: utf-8
+"""
+Setup shared by the benchmarks: one point of the BM3 hyper-parameter grid, its loaders and model, timed training
+steps, tensor / optimizer-state sizes and timed propagation layers.
+##########################
+"""
+from time import time
+
+import torch
+
+from utils.configurator import Config
+from utils.dataset import RecDataset
+from utils.dataloader import TrainDataLoader, EvalDataLoader
+from models.bm3 import BM3
+
+
+# the list-valued hyper-parameters of BM3.yaml fixed to one point of the grid
+GRID_POINT = {'n_layers': 2, 'reg_weight': 0.01, 'mm_weight': 1.0, 'dropout': 0.5}
+
+
+def bm3_config(dataset, **overrides):
+    r"""BM3 config on the cpu at :data:`GRID_POINT`, with ``overrides`` applied and a single seed.
+    """
+    config = Config('BM3', dataset, dict({'use_gpu': False}, **dict(GRID_POINT, **overrides)))
+    config['seed'] = config['seed'][0]
+    return config
+
+
+def load_data(config, eval_loaders=False):
+    r"""Split the dataset and build the training loader, and the valid / test loaders when asked.
+
+    Returns:
+        TrainDataLoader, or (train, valid, test) loaders with ``eval_loaders``
+    """
+    train_dataset, valid_dataset, test_dataset = RecDataset(config).split()
+    # the loaders read the interaction counts computed by __str__
+    for split in (train_dataset, valid_dataset, test_dataset):
+        str(split)
+    train_data = TrainDataLoader(config, train_dataset, batch_size=config['train_batch_size'], shuffle=True)
+    if not eval_loaders:
+        return train_data
+    valid_data = EvalDataLoader(config, valid_dataset, additional_dataset=train_dataset,
+                                batch_size=config['eval_batch_size'])
+    test_data = EvalDataLoader(config, test_dataset, additional_dataset=train_dataset,
+                               batch_size=config['eval_batch_size'])
+    return train_data, valid_data, test_data
+
+
+def build_model(config, train_data):
+    r"""BM3 initialised from the config seed, in training mode.
+    """
+    torch.manual_seed(config['seed'])
+    model = BM3(config, train_data)
+    model.train()
+    return model
+
+
+def train_steps(model, optimizer, train_data, steps, grad_params=None):
+    r"""Mean seconds per training step (zero_grad, loss, backward, step) over ``steps`` steps after one untimed
+    step, which allocates the optimizer state.
+
+    Returns:
+        (float, int): seconds per step and the largest gradient bytes of ``grad_params`` (all parameters if None)
+    """
+    batches = iter(train_data)
+    cost, grad_bytes = 0.0, 0
+    for step in range(steps + 1):
+        interaction = next(batches, None)
+        if interaction is None:
+            batches = iter(train_data)
+            interaction = next(batches)
+        start = time()
+        optimizer.zero_grad()
+        model.calculate_loss(interaction).backward()
+        params = grad_params if grad_params is not None else list(model.parameters())
+        grad_bytes = max(grad_bytes, sum(tensor_bytes(p.grad) for p in params if p.grad is not None))
+        optimizer.step()
+        cost += (time() - start) if step else 0.0
+    return cost / steps, grad_bytes
+
+
+def tensor_bytes(t):
+    if t.is_sparse:
+        t = t.coalesce()
+        return tensor_bytes(t.indices()) + tensor_bytes(t.values())
+    return t.element_size() * t.nelement()
+
+
+def optimizer_state_bytes(optimizer):
+    optimizers = getattr(optimizer, 'optimizers', [optimizer])
+    return sum(tensor_bytes(v) for o in optimizers for state in o.state.values() for v in state.values()
+               if torch.is_tensor(v))
+
+
+def time_layers(adj, x, n_layers, repeat):
+    """Seconds per propagation (forward and backward) after one warm-up call, and the forward output."""
+    def run():
+        out, e = x, x
+        for _ in range(n_layers):
+            e = adj.mm(e)
+            out = out + e
+        return out
+    run().sum().backward()
+    start = time()
+    for _ in range(repeat):
+        run().sum().backward()
+    cost = (time() - start) / repeat
+    with torch.no_grad():
+        return cost, run()
@@ -0,0 +1,66 @@
+# coding: utf-8
+"""
+EvalDataLoader construction time against the number of eval users,
+per-user groupby lookups vs. the vectorized build.
+Run from ``src``:  python -m benchmarks.eval_loader -d baby
+##########################
+"""
+import argparse
+from time import time
+
+import numpy as np
+
+from utils.configurator import Config
+from utils.dataset import RecDataset
+from utils.dataloader import EvalDataLoader
+
+
+def groupby_build(eval_dataset, train_dataset):
+    """The per-user construction EvalDataLoader used before, as a reference. Its training items keep duplicate
+    (user, item) rows, which the CSR history stores once; both mask the same entries."""
+    uid, iid = eval_dataset.uid_field, eval_dataset.iid_field
+    eval_u = eval_dataset.df[uid].unique()
+    train_freq = train_dataset.df.groupby(uid)[iid]
+    u_ids, i_ids, train_items_per_u = [], [], []
+    for i, u in enumerate(eval_u):
+        u_ls = train_freq.get_group(u).values
+        train_items_per_u.append(u_ls)
+        u_ids.extend([i] * len(u_ls))
+        i_ids.extend(u_ls)
+    eval_freq = eval_dataset.df.groupby(uid)[iid]
+    eval_items_per_u = [eval_freq.get_group(u).values for u in eval_u]
+    return train_items_per_u, eval_items_per_u
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', '-d', type=str, default='baby', help='name of datasets')
+    parser.add_argument('--fractions', type=float, nargs='+', default=[0.1, 0.25, 0.5, 1.0],
+                        help='shares of the test users to build loaders for')
+    args, _ = parser.parse_known_args()
+
+    config = Config('BM3', args.dataset, {'use_gpu': False})
+    train_dataset, _, test_dataset = RecDataset(config).split()
+    str(train_dataset)
+    uid = test_dataset.uid_field
+    all_u = test_dataset.df[uid].unique()
+
+    print('{:>8} {:>12} {:>12} {:>8}'.format('users', 'groupby(s)', 'vector(s)', 'same'))
+    for frac in args.fractions:
+        users = all_u[:max(1, int(len(all_u) * frac))]
+        sub = test_dataset.copy(test_dataset.df[test_dataset.df[uid].isin(users)])
+        str(sub)
+
+        start = time()
+        ref_train_items, ref_items = groupby_build(sub, train_dataset)
+        ref_cost = time() - start
+
+        start = time()
+        loader = EvalDataLoader(config, sub, additional_dataset=train_dataset, batch_size=config['eval_batch_size'])
+        vec_cost = time() - start
+
+        # masked training items compared as sets, eval items in file order
+        train_items = np.split(loader.pos_items.cpu().numpy(), loader.pos_indptr[1:-1])
+        same = all(np.array_equal(np.unique(a), b) for a, b in zip(ref_train_items, train_items)) and \
+            all(np.array_equal(a, b) for a, b in zip(ref_items, loader.get_eval_items()))
+        print('{:>8} {:>12.3f} {:>12.3f} {:>8}'.format(len(users), ref_cost, vec_cost, str(same)))
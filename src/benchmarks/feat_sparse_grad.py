@@ -0,0 +1,40 @@
+# coding: utf-8
+"""
+Gradient / optimizer-state memory and step time of the raw feature tables with dense gradients and Adam against
+sparse row gradients and SparseAdam (both on the sliced loss, with ``mm_weight`` 0 as the sparse mode requires).
+Run from ``src``:  python -m benchmarks.feat_sparse_grad -d baby
+##########################
+"""
+import shutil
+import argparse
+import tempfile
+
+from common.trainer import Trainer
+from benchmarks.bench_utils import bm3_config, load_data, build_model, train_steps, tensor_bytes, \
+    optimizer_state_bytes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', '-d', type=str, default='baby', help='name of datasets')
+    parser.add_argument('--steps', type=int, default=20, help='timed training steps per mode')
+    args, _ = parser.parse_known_args()
+
+    checkpoint_dir = tempfile.mkdtemp(prefix='feat_sparse_grad_')
+    print('{:>7} {:>12} {:>12} {:>12} {:>14} {:>10}'.format(
+        'mode', 'tables(MB)', 'grads(MB)', 'state(MB)', 'step(ms)', 'speedup'))
+    for sparse in [False, True]:
+        config = bm3_config(args.dataset, mm_weight=0.0, sliced_loss=True, feat_sparse_grad=sparse,
+                            checkpoint_dir=checkpoint_dir)
+        train_data = load_data(config)
+        model = build_model(config, train_data)
+        optimizer = Trainer(config, model).optimizer
+        tables = [m.weight for m in [getattr(model, 'image_embedding', None), getattr(model, 'text_embedding', None)]
+                  if m is not None]
+
+        cost, grad_bytes = train_steps(model, optimizer, train_data, args.steps, grad_params=tables)
+        base = cost if not sparse else base
+        print('{:>7} {:>12.1f} {:>12.1f} {:>12.1f} {:>14.2f} {:>10.2f}'.format(
+            'sparse' if sparse else 'dense', sum(tensor_bytes(t) for t in tables) / 1024.0 ** 2,
+            grad_bytes / 1024.0 ** 2, optimizer_state_bytes(optimizer) / 1024.0 ** 2, cost * 1e3, base / cost))
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
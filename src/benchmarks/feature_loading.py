@@ -0,0 +1,55 @@
+# coding: utf-8
+"""
+Load time and resident memory of the multimodal feature tables per loading mode.
+Every mode runs in a fresh process so peak rss is not shared between modes.
+Run from ``src``:  python -m benchmarks.feature_loading -d baby
+##########################
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+from time import time
+
+from utils.configurator import Config
+from utils.utils import get_memory_usage
+
+MODES = [(False, 'float32'), (True, 'float32'), (True, 'float16'), (True, 'bfloat16'), (False, 'float16')]
+
+
+def load_once(file_paths, mmap, dtype):
+    from common.abstract_recommender import load_feature
+    start = time()
+    feats = [load_feature(p, mmap, dtype) for p in file_paths]
+    # touch every row, as training does
+    checksum = sum(float(f[s: s + 65536].float().sum()) for f in feats for s in range(0, f.shape[0], 65536))
+    cost = time() - start
+    cur_rss, peak_rss = get_memory_usage()
+    return {'time': cost, 'rss': cur_rss, 'peak_rss': peak_rss, 'checksum': checksum}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', '-d', type=str, default='baby', help='name of datasets')
+    parser.add_argument('--worker', type=str, default=None, help=argparse.SUPPRESS)
+    args, _ = parser.parse_known_args()
+
+    if args.worker is not None:
+        job = json.loads(args.worker)
+        print(json.dumps(load_once(job['files'], job['mmap'], job['dtype'])))
+        sys.exit(0)
+
+    config = Config('BM3', args.dataset, {'use_gpu': False})
+    dataset_path = os.path.abspath(config['data_path'] + config['dataset'])
+    files = [os.path.join(dataset_path, config[k]) for k in ['vision_feature_file', 'text_feature_file']]
+    files = [f for f in files if os.path.isfile(f)]
+
+    print('{:<6} {:<9} {:>8} {:>10} {:>10}'.format('mmap', 'dtype', 'time(s)', 'rss(MB)', 'peak(MB)'))
+    for mmap, dtype in MODES:
+        job = json.dumps({'files': files, 'mmap': mmap, 'dtype': dtype})
+        out = subprocess.run([sys.executable, '-m', 'benchmarks.feature_loading', '--worker', job],
+                             capture_output=True, text=True, check=True).stdout
+        res = json.loads(out.strip().splitlines()[-1])
+        print('{:<6} {:<9} {:>8.3f} {:>10.0f} {:>10.0f}'.format(str(mmap), dtype, res['time'], res['rss'],
+                                                               res['peak_rss']))
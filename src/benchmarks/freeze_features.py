@@ -0,0 +1,41 @@
+# coding: utf-8
+"""
+Memory and step time of BM3 with trainable raw feature tables against freeze_features, where only the
+text/image projections train and the tables get no gradients or Adam moments.
+Run from ``src``:  python -m benchmarks.freeze_features -d baby
+##########################
+"""
+import shutil
+import argparse
+import tempfile
+
+from common.trainer import Trainer
+from benchmarks.bench_utils import bm3_config, load_data, build_model, train_steps, tensor_bytes, \
+    optimizer_state_bytes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', '-d', type=str, default='baby', help='name of datasets')
+    parser.add_argument('--steps', type=int, default=20, help='timed training steps per mode')
+    args, _ = parser.parse_known_args()
+
+    checkpoint_dir = tempfile.mkdtemp(prefix='freeze_features_')
+    print('{:>9} {:>12} {:>12} {:>12} {:>12} {:>10}'.format(
+        'tables', 'tables(MB)', 'grads(MB)', 'state(MB)', 'step(ms)', 'speedup'))
+    base = None
+    for frozen in [False, True]:
+        config = bm3_config(args.dataset, freeze_features=frozen, checkpoint_dir=checkpoint_dir)
+        train_data = load_data(config)
+        model = build_model(config, train_data)
+        optimizer = Trainer(config, model).optimizer
+        # the raw tables and, for frozen 16-bit ones, their float32 upcast cache
+        tables = [m.weight for m in [getattr(model, 'image_embedding', None), getattr(model, 'text_embedding', None)]
+                  if m is not None] + [b for name, b in model.named_buffers() if name.endswith('_feat32')]
+
+        cost, grad_bytes = train_steps(model, optimizer, train_data, args.steps)
+        base = base or cost
+        print('{:>9} {:>12.1f} {:>12.1f} {:>12.1f} {:>12.2f} {:>10.2f}'.format(
+            'frozen' if frozen else 'trainable', sum(tensor_bytes(t) for t in tables) / 1024.0 ** 2,
+            grad_bytes / 1024.0 ** 2, optimizer_state_bytes(optimizer) / 1024.0 ** 2, cost * 1e3, base / cost))
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
@@ -0,0 +1,52 @@
+# coding: utf-8
+"""
+Build time and memory of the CSR history index vs. groupby dict-of-sets.
+Run from ``src``:  python -m benchmarks.history_index -d baby
+##########################
+"""
+import sys
+import argparse
+from time import time
+
+from utils.configurator import Config
+from utils.dataset import RecDataset
+from utils.history_index import HistoryIndex
+
+
+def dict_of_sets(df, key_field, value_field):
+    ret = {}
+    for k, ls in df.groupby(key_field)[value_field]:
+        ret[k] = set(ls.values)
+    return ret
+
+
+def dict_of_sets_nbytes(d):
+    total = sys.getsizeof(d)
+    for k, v in d.items():
+        total += sys.getsizeof(k) + sys.getsizeof(v) + sum(sys.getsizeof(x) for x in v)
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', '-d', type=str, default='baby', help='name of datasets')
+    args, _ = parser.parse_known_args()
+
+    config = Config('BM3', args.dataset, {'use_gpu': False})
+    train_dataset = RecDataset(config).split()[0]
+    df, uid, iid = train_dataset.df, train_dataset.uid_field, train_dataset.iid_field
+
+    start = time()
+    u2i, i2u = dict_of_sets(df, uid, iid), dict_of_sets(df, iid, uid)
+    dict_cost = time() - start
+    dict_mb = (dict_of_sets_nbytes(u2i) + dict_of_sets_nbytes(i2u)) / 1024.0 ** 2
+
+    start = time()
+    index = HistoryIndex(df[uid].values, df[iid].values, train_dataset.user_num, train_dataset.item_num)
+    csr_cost = time() - start
+    csr_mb = index.nbytes() / 1024.0 ** 2
+
+    print('dataset: {}, train interactions: {}'.format(args.dataset, len(df)))
+    print('dict of sets: {:.3f}s {:>10.2f}MB'.format(dict_cost, dict_mb))
+    print('csr index:    {:.3f}s {:>10.2f}MB  (x{:.1f} faster, x{:.1f} smaller)'.format(
+        csr_cost, csr_mb, dict_cost / max(csr_cost, 1e-9), dict_mb / max(csr_mb, 1e-9)))
@@ -0,0 +1,53 @@
+# coding: utf-8
+"""
+Training time per epoch and final test Recall/NDCG of exact BM3 propagation against historical embeddings
+refreshed every k steps or once per epoch, each trained from the same seed for the same epochs.
+Run from ``src``:  python -m benchmarks.history_propagation -d baby
+##########################
+"""
+import shutil
+import argparse
+import tempfile
+from time import time
+
+from utils.utils import init_seed
+from models.bm3 import BM3
+from common.trainer import Trainer
+from benchmarks.bench_utils import bm3_config, load_data
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', '-d', type=str, default='baby', help='name of datasets')
+    parser.add_argument('--refresh', type=str, nargs='+', default=['0', '2', '8', 'epoch'],
+                        help='history_refresh values (0: exact)')
+    parser.add_argument('--epochs', type=int, default=20, help='training epochs per setting')
+    args, _ = parser.parse_known_args()
+
+    checkpoint_dir = tempfile.mkdtemp(prefix='history_propagation_')
+    print('dataset: {}, epochs: {}'.format(args.dataset, args.epochs))
+    print('{:>8} {:>14} {:>8} {:>10} {:>10}'.format('refresh', 'epoch(s)', 'speedup', 'recall@20', 'ndcg@20'))
+    base = None
+    for refresh in args.refresh:
+        # evaluated every epoch so the best-valid test result is comparable
+        config = bm3_config(args.dataset, epochs=args.epochs, stopping_step=args.epochs,
+                            history_refresh=refresh if refresh == 'epoch' else int(refresh),
+                            checkpoint_dir=checkpoint_dir)
+        init_seed(config['seed'])
+        train_data, valid_data, test_data = load_data(config, eval_loaders=True)
+        trainer = Trainer(config, BM3(config, train_data))
+        train_time = [0.0]
+        train_epoch = trainer._train_epoch
+
+        def timed_epoch(*epoch_args, **epoch_kwargs):
+            start = time()
+            out = train_epoch(*epoch_args, **epoch_kwargs)
+            train_time[0] += time() - start
+            return out
+        trainer._train_epoch = timed_epoch
+        _, _, test_result = trainer.fit(train_data, valid_data=valid_data, test_data=test_data, verbose=False)
+        cost = train_time[0] / args.epochs
+        base = base or cost
+        print('{:>8} {:>14.3f} {:>8.2f} {:>10.4f} {:>10.4f}'.format(
+            refresh, cost, base / cost, test_result['recall@20'], test_result['ndcg@20']))
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
@@ -0,0 +1,47 @@
+# coding: utf-8
+"""
+Cold vs. warm load time of the binary .inter cache.
+Run from ``src``:  python -m benchmarks.inter_cache -d baby
+##########################
+"""
+import shutil
+import tempfile
+import argparse
+from time import time
+
+from utils.configurator import Config
+from utils.dataset import RecDataset
+
+
+def timed_load(config, repeat):
+    costs = []
+    for _ in range(repeat):
+        start = time()
+        dataset = RecDataset(config)
+        costs.append(time() - start)
+    return min(costs), len(dataset)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', '-d', type=str, default='baby', help='name of datasets')
+    parser.add_argument('--repeat', type=int, default=3, help='timed repetitions, the best one is reported')
+    args, _ = parser.parse_known_args()
+
+    config = Config('BM3', args.dataset, {'use_gpu': False})
+
+    config['inter_cache'] = False
+    csv_cost, n_inter = timed_load(config, args.repeat)
+
+    # a fresh cache dir makes the first cached load a cold one
+    config['inter_cache'] = True
+    config['cache_dir'] = tempfile.mkdtemp(prefix='inter_cache_')
+    cold_cost, _ = timed_load(config, 1)
+    warm_cost, _ = timed_load(config, args.repeat)
+
+    shutil.rmtree(config['cache_dir'], ignore_errors=True)
+
+    print('dataset: {}, interactions: {}'.format(args.dataset, n_inter))
+    print('csv parse:   {:.3f}s'.format(csv_cost))
+    print('cache cold:  {:.3f}s'.format(cold_cost))
+    print('cache warm:  {:.3f}s  (x{:.1f} vs csv)'.format(warm_cost, csv_cost / max(warm_cost, 1e-9)))
@@ -0,0 +1,69 @@
+# coding: utf-8
+"""
+Activation memory and time of BM3 graph propagation with stacked vs. running-sum layer aggregation,
+for n_layers 1..4. Every setting runs in a fresh process (without the feature tables) so peak rss is its own;
+glibc's mmap threshold is pinned so large tensors go straight back to the OS when freed and rss follows them.
+Run from ``src``:  python -m benchmarks.layer_agg -d baby
+##########################
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+from time import time
+
+import torch
+
+from utils.configurator import Config
+from utils.utils import get_memory_usage
+
+
+def propagate_once(dataset, n_layers, layer_agg, adj_mode, dim):
+    from utils.dataset import RecDataset
+    from utils.dataloader import TrainDataLoader
+    from models.bm3 import BM3
+
+    config = Config('BM3', dataset, {'use_gpu': False, 'is_multimodal_model': False, 'n_layers': n_layers,
+                                     'layer_agg': layer_agg, 'adj_mode': adj_mode, 'embedding_size': dim})
+    train_dataset = RecDataset(config).split()[0]
+    str(train_dataset)
+    torch.manual_seed(config['seed'][0])
+    model = BM3(config, TrainDataLoader(config, train_dataset, batch_size=config['train_batch_size']))
+
+    rss_before, _ = get_memory_usage()
+    start = time()
+    u_g, i_g = model._propagate()
+    forward = time() - start
+    (u_g.sum() + i_g.sum()).backward()
+    cost = time() - start
+    _, peak = get_memory_usage()
+    return {'peak': peak - rss_before, 'forward': forward, 'time': cost, 'checksum': float(u_g.sum() + i_g.sum())}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', '-d', type=str, default='baby', help='name of datasets')
+    parser.add_argument('--adj_mode', type=str, default='full', help='full or bipartite')
+    parser.add_argument('--dim', type=int, default=64, help='embedding size')
+    parser.add_argument('--worker', type=str, default=None, help=argparse.SUPPRESS)
+    args, _ = parser.parse_known_args()
+
+    if args.worker is not None:
+        job = json.loads(args.worker)
+        print(json.dumps(propagate_once(args.dataset, job['n_layers'], job['layer_agg'], args.adj_mode, args.dim)))
+        sys.exit(0)
+
+    env = dict(os.environ, MALLOC_MMAP_THRESHOLD_='131072')
+    print('peak: rss growth over forward + backward')
+    print('{:>8} {:>6} {:>10} {:>12} {:>10} {:>12}'.format(
+        'n_layers', 'agg', 'peak(MB)', 'forward(ms)', 'f+b(ms)', 'checksum'))
+    for n_layers in range(1, 5):
+        for layer_agg in ['stack', 'sum']:
+            job = json.dumps({'n_layers': n_layers, 'layer_agg': layer_agg})
+            out = subprocess.run([sys.executable, '-m', 'benchmarks.layer_agg', '-d', args.dataset, '--adj_mode',
+                                  args.adj_mode, '--dim', str(args.dim), '--worker', job],
+                                 capture_output=True, text=True, check=True, env=env).stdout
+            res = json.loads(out.strip().splitlines()[-1])
+            print('{:>8} {:>6} {:>10.1f} {:>12.2f} {:>10.2f} {:>12.4f}'.format(
+                n_layers, layer_agg, res['peak'], res['forward'] * 1e3, res['time'] * 1e3, res['checksum']))
@@ -0,0 +1,51 @@
+# coding: utf-8
+"""
+Samples/sec of the per-user negative sampling loop vs. the vectorized sampler.
+Run from ``src``:  python -m benchmarks.neg_sampling -d baby
+##########################
+"""
+import argparse
+from time import time
+
+import numpy as np
+
+from utils.configurator import Config
+from utils.dataset import RecDataset
+from utils.dataloader import TrainDataLoader
+from utils.utils import init_seed
+
+
+def samples_per_sec(train_data, batches):
+    start = time()
+    n = 0
+    for u_ids in batches:
+        n += train_data._sample_neg_ids(u_ids).numel()
+    return n / (time() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', '-d', type=str, default='baby', help='name of datasets')
+    parser.add_argument('--batch_size', type=int, default=2048, help='users per batch')
+    parser.add_argument('--n_batches', type=int, default=50, help='batches timed per sampler')
+    parser.add_argument('--neg_nums', type=int, nargs='+', default=[1, 4, 16], help='negatives per positive')
+    args, _ = parser.parse_known_args()
+
+    config = Config('BM3', args.dataset, {'use_gpu': False, 'use_neg_sampling': True})
+    init_seed(999)
+    train_dataset = RecDataset(config).split()[0]
+    print(train_dataset)
+    uids = train_dataset.df[train_dataset.uid_field].values
+    batches = [uids[s: s + args.batch_size] for s in range(0, len(uids), args.batch_size)][:args.n_batches]
+    print('dataset: {}, batches: {} x {}'.format(args.dataset, len(batches), args.batch_size))
+
+    config['vectorized_neg_sampling'] = False
+    loop_rate = samples_per_sec(TrainDataLoader(config, train_dataset, batch_size=args.batch_size), batches)
+    print('loop       neg=1   {:>12.0f} samples/s'.format(loop_rate))
+
+    config['vectorized_neg_sampling'] = True
+    for k in args.neg_nums:
+        config['training_neg_sample_num'] = k
+        train_data = TrainDataLoader(config, train_dataset, batch_size=args.batch_size)
+        rate = samples_per_sec(train_data, batches)
+        print('vectorized neg={:<3} {:>12.0f} samples/s  (x{:.1f})'.format(k, rate, rate / loop_rate))
@@ -0,0 +1,70 @@
+# coding: utf-8
+"""
+Propagation time over the normalized adjacency with the original node ids vs. degree / RCM relabeling.
+Run from ``src``:  python -m benchmarks.node_reorder -d baby
+##########################
+"""
+import argparse
+from time import time
+
+import numpy as np
+import torch
+
+from utils.configurator import Config
+from utils.dataset import RecDataset
+from utils.reorder import REORDER_METHODS, node_order, inverse_permutation
+from common.graph import PropagationMatrix, norm_adj_arrays
+
+
+def mean_row_span(indices):
+    """Average distance between the first and last neighbor of each row: the embedding span one row touches.
+    """
+    starts = np.flatnonzero(np.r_[True, indices[0][1:] != indices[0][:-1]])
+    return float((np.maximum.reduceat(indices[1], starts) - np.minimum.reduceat(indices[1], starts)).mean())
+
+
+def propagate(adj, x, n_layers):
+    out = x
+    for _ in range(n_layers):
+        x = adj.mm(x)
+        out = out + x
+    return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', '-d', type=str, default='baby', help='name of datasets')
+    parser.add_argument('--format', type=str, default='coo', help='adj_format')
+    parser.add_argument('--layers', type=int, default=2, help='n_layers')
+    parser.add_argument('--repeat', type=int, default=10, help='timed propagations per method')
+    args, _ = parser.parse_known_args()
+
+    config = Config('BM3', args.dataset, {'use_gpu': False})
+    train_dataset = RecDataset(config).split()[0]
+    users = train_dataset.df[train_dataset.uid_field].values.astype(np.int64)
+    items = train_dataset.df[train_dataset.iid_field].values.astype(np.int64)
+    n_users, n_items = train_dataset.get_user_num(), train_dataset.get_item_num()
+    n_nodes = n_users + n_items
+
+    print('dataset: {}, nodes: {}, layers: {}, format: {}'.format(args.dataset, n_nodes, args.layers, args.format))
+    print('{:>8} {:>10} {:>16} {:>12} {:>8}'.format('method', 'order(s)', 'mean row span', 'f+b(ms)', 'speedup'))
+    base = None
+    for method in ('none',) + REORDER_METHODS:
+        start = time()
+        u, i = users, items
+        if method != 'none':
+            user_perm, item_perm = node_order(users, items, n_users, n_items, method)
+            u, i = inverse_permutation(user_perm)[users], inverse_permutation(item_perm)[items]
+        order_cost = time() - start
+        indices, values = norm_adj_arrays(u, i, n_users, n_items)
+        adj = PropagationMatrix(indices, values, (n_nodes, n_nodes), args.format)
+        torch.manual_seed(0)
+        x = torch.randn(n_nodes, config['embedding_size'], requires_grad=True)
+        propagate(adj, x, args.layers).sum().backward()
+        start = time()
+        for _ in range(args.repeat):
+            propagate(adj, x, args.layers).sum().backward()
+        cost = (time() - start) / args.repeat
+        base = base or cost
+        print('{:>8} {:>10.3f} {:>16.1f} {:>12.2f} {:>8.2f}'.format(
+            method, order_cost, mean_row_span(indices), cost * 1e3, base / cost))
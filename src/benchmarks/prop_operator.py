@@ -0,0 +1,72 @@
+# coding: utf-8
+"""
+Fill-in, speed and accuracy of the precomputed propagation operator P = mean(I, A, ..., A^L) against the
+layer-by-layer propagation, for several layer counts and pruning settings.
+Run from ``src``:  python -m benchmarks.prop_operator -d baby
+##########################
+"""
+import argparse
+from time import time
+
+import torch
+
+from utils.configurator import Config
+from utils.dataset import RecDataset
+from common.graph import PropagationMatrix, norm_adj_arrays, propagation_operator_arrays
+
+
+def layers_propagate(adj, x, n_layers):
+    out = x
+    for _ in range(n_layers):
+        x = adj.mm(x)
+        out = out + x
+    return out / (n_layers + 1)
+
+
+def time_call(fn, x, repeat):
+    """Seconds per call, forward and backward to ``x``, after one warm-up call."""
+    fn(x).sum().backward()
+    start = time()
+    for _ in range(repeat):
+        fn(x).sum().backward()
+    return (time() - start) / repeat
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', '-d', type=str, default='baby', help='name of datasets')
+    parser.add_argument('--layers', type=int, nargs='+', default=[1, 2, 3], help='n_layers values')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.0, 1e-4, 1e-3], help='prune thresholds')
+    parser.add_argument('--topks', type=int, nargs='+', default=[0, 64], help='per-row top-k (0: all)')
+    parser.add_argument('--repeat', type=int, default=10, help='timed calls per setting')
+    args, _ = parser.parse_known_args()
+
+    config = Config('BM3', args.dataset, {'use_gpu': False})
+    train_dataset = RecDataset(config).split()[0]
+    users = train_dataset.df[train_dataset.uid_field].values
+    items = train_dataset.df[train_dataset.iid_field].values
+    n_nodes = train_dataset.get_user_num() + train_dataset.get_item_num()
+    indices, values = norm_adj_arrays(users, items, train_dataset.get_user_num(), train_dataset.get_item_num())
+    adj = PropagationMatrix(indices, values, (n_nodes, n_nodes))
+    x = torch.randn(n_nodes, config['embedding_size'], requires_grad=True)
+
+    print('dataset: {}, nodes: {}, adjacency nnz: {}'.format(args.dataset, n_nodes, len(values)))
+    print('{:>6} {:>9} {:>5} {:>10} {:>8} {:>9} {:>10} {:>11} {:>8} {:>10}'.format(
+        'layers', 'threshold', 'topk', 'nnz', 'fill-in', 'build(s)', 'P f+b(ms)', 'layers(ms)', 'speedup',
+        'rel. err'))
+    for n_layers in args.layers:
+        layers_cost = time_call(lambda e: layers_propagate(adj, e, n_layers), x, args.repeat)
+        with torch.no_grad():
+            reference = layers_propagate(adj, x, n_layers)
+        for threshold in args.thresholds:
+            for topk in args.topks:
+                start = time()
+                p_indices, p_values = propagation_operator_arrays(indices, values, n_nodes, n_layers, threshold, topk)
+                build = time() - start
+                op = PropagationMatrix(p_indices, p_values, (n_nodes, n_nodes))
+                cost = time_call(op.mm, x, args.repeat)
+                with torch.no_grad():
+                    err = float(torch.norm(op.mm(x) - reference) / torch.norm(reference))
+                print('{:>6} {:>9.0e} {:>5} {:>10} {:>8.2f} {:>9.2f} {:>10.2f} {:>11.2f} {:>8.2f} {:>10.2e}'.format(
+                    n_layers, threshold, topk, len(p_values), len(p_values) / len(values), build, cost * 1e3,
+                    layers_cost * 1e3, layers_cost / max(cost, 1e-9), err))
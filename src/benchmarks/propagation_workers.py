@@ -0,0 +1,52 @@
+# coding: utf-8
+"""
+Propagation time of the adjacency split over worker processes against the single-process csr product.
+Run from ``src``:  python -m benchmarks.propagation_workers -d baby
+##########################
+"""
+import argparse
+
+import torch
+
+from utils.configurator import Config
+from utils.dataset import RecDataset
+from common.graph import PropagationMatrix, norm_adj_arrays
+from common.graph_workers import PartitionedPropagationMatrix
+from benchmarks.bench_utils import time_layers
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', '-d', type=str, default='baby', help='name of datasets')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='propagation_workers values')
+    parser.add_argument('--layers', type=int, default=2, help='n_layers')
+    parser.add_argument('--repeat', type=int, default=10, help='timed propagations per setting')
+    args, _ = parser.parse_known_args()
+
+    config = Config('BM3', args.dataset, {'use_gpu': False})
+    train_dataset = RecDataset(config).split()[0]
+    users = train_dataset.df[train_dataset.uid_field].values
+    items = train_dataset.df[train_dataset.iid_field].values
+    n_nodes = train_dataset.get_user_num() + train_dataset.get_item_num()
+    indices, values = norm_adj_arrays(users, items, train_dataset.get_user_num(), train_dataset.get_item_num())
+    x = torch.randn(n_nodes, config['embedding_size'], requires_grad=True)
+
+    print('dataset: {}, nodes: {}, nnz: {}, layers: {}, cpu threads: {}'.format(
+        args.dataset, n_nodes, len(values), args.layers, torch.get_num_threads()))
+    print('{:>8} {:>12} {:>10} {:>12} {:>12} {:>12}'.format(
+        'workers', 'f+b(ms)', 'speedup', 'efficiency', 'max busy', 'max diff'))
+    base, reference = time_layers(PropagationMatrix(indices, values, (n_nodes, n_nodes), 'csr'), x, args.layers,
+                                  args.repeat)
+    print('{:>8} {:>12.2f} {:>10} {:>12} {:>12} {:>12}'.format('csr', base * 1e3, '-', '-', '-', '-'))
+    single = None
+    for n_workers in args.workers:
+        adj = PartitionedPropagationMatrix(indices, values, n_nodes, config['embedding_size'], n_workers)
+        cost, out = time_layers(adj, x, args.layers, args.repeat)
+        # share of a product the slowest worker was busy: below 1 means the rest went to dispatch and copies
+        busy = adj.busy.max() / adj.n_calls / (cost / (2 * args.layers))
+        adj.close()
+        # scaling efficiency t1 / (n * tn) against the one-worker run
+        single = single or cost * n_workers
+        print('{:>8} {:>12.2f} {:>10.2f} {:>12.2f} {:>12.2f} {:>12.2e}'.format(
+            n_workers, cost * 1e3, base / cost, single / (n_workers * cost), busy,
+            float((out - reference).abs().max())))
@@ -0,0 +1,50 @@
+# coding: utf-8
+"""
+Training step time of the full-table BM3 loss against the batch-sliced loss, across datasets of growing catalog
+size, with the largest gradient difference between the two (dropout off, so both see the same targets), and the
+sliced loss with ``sliced_reg`` (batch-row regularization, a different objective).
+Run from ``src``:  python -m benchmarks.sliced_loss -d baby sports clothing
+##########################
+"""
+import argparse
+from time import time
+
+from benchmarks.bench_utils import bm3_config, load_data, build_model
+
+
+def step_time(model, interaction, repeat):
+    """Seconds per loss + backward after one warm-up call, and the gradients of the last call."""
+    def run():
+        model.zero_grad()
+        model.calculate_loss(interaction).backward()
+    run()
+    start = time()
+    for _ in range(repeat):
+        run()
+    cost = (time() - start) / repeat
+    return cost, {name: p.grad.clone() for name, p in model.named_parameters() if p.grad is not None}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', '-d', type=str, nargs='+', default=['baby'], help='name of datasets')
+    parser.add_argument('--repeat', type=int, default=10, help='timed steps per setting')
+    args, _ = parser.parse_known_args()
+
+    print('{:>10} {:>8} {:>8} {:>8} {:>12} {:>12} {:>8} {:>10} {:>12} {:>8}'.format(
+        'dataset', 'users', 'items', 'batch', 'full(ms)', 'sliced(ms)', 'speedup', 'grad diff', '+reg(ms)',
+        'speedup'))
+    for dataset in args.dataset:
+        config = bm3_config(dataset, dropout=0.0)
+        train_data = load_data(config)
+        model = build_model(config, train_data)
+        interaction = next(iter(train_data))
+
+        costs, grads = {}, {}
+        for mode in ['full', 'sliced', 'sliced_reg']:
+            model.sliced_loss, model.sliced_reg = mode != 'full', mode == 'sliced_reg'
+            costs[mode], grads[mode] = step_time(model, interaction, args.repeat)
+        diff = max(float((grads['full'][name] - grads['sliced'][name]).abs().max()) for name in grads['full'])
+        print('{:>10} {:>8} {:>8} {:>8} {:>12.2f} {:>12.2f} {:>8.2f} {:>10.2e} {:>12.2f} {:>8.2f}'.format(
+            dataset, model.n_users, model.n_items, len(interaction[0]), costs['full'] * 1e3, costs['sliced'] * 1e3,
+            costs['full'] / costs['sliced'], diff, costs['sliced_reg'] * 1e3, costs['full'] / costs['sliced_reg']))
@@ -5,6 +5,70 @@ import os
 import numpy as np
 import torch
 import torch.nn as nn
+from time import time
+from logging import getLogger
+
+from utils.utils import get_memory_usage
+from utils.cache_utils import file_digest, array_digest, config_digest, save_permuted_rows
+
+
+# storage dtypes of the raw multimodal features, upcast to float32 where they are consumed
+FEAT_DTYPES = {'float32': torch.float32, 'float16': torch.float16, 'bfloat16': torch.bfloat16}
+
+
+def load_feature(file_path, mmap=False, dtype='float32', chunk_rows=65536):
+    r"""Load a ``.npy`` feature table as a torch tensor.
+
+    Args:
+        file_path (str): the ``.npy`` file
+        mmap (bool): memory-map the file (copy-on-write) instead of reading it into memory.
+            A float32 file is then used without any copy.
+        dtype (str): storage dtype, one of :attr:`FEAT_DTYPES`
+        chunk_rows (int): rows converted at a time when ``dtype`` differs from the file, bounding peak memory
+
+    Returns:
+        torch.Tensor: (n_items, feat_dim) features in ``dtype``
+    """
+    if dtype not in FEAT_DTYPES:
+        raise ValueError('feat_dtype [{}] should be one of {}'.format(dtype, list(FEAT_DTYPES)))
+    target = FEAT_DTYPES[dtype]
+    start = time()
+    if mmap:
+        arr = np.load(file_path, mmap_mode='c')
+    else:
+        arr = np.load(file_path, allow_pickle=True)
+    if arr.dtype == np.float32 and target == torch.float32:
+        feat = torch.from_numpy(arr)
+    elif not mmap and target == torch.float32:
+        feat = torch.from_numpy(arr).type(torch.FloatTensor)
+    else:
+        feat = torch.empty(arr.shape, dtype=target)
+        for s in range(0, arr.shape[0], chunk_rows):
+            feat[s: s + chunk_rows] = torch.from_numpy(np.asarray(arr[s: s + chunk_rows], dtype=np.float32))
+        del arr
+    cur_rss, peak_rss = get_memory_usage()
+    getLogger().info('feature {} loaded [mmap: {}, dtype: {}, shape: {}, time: {:.2f}s, rss: {:.0f}MB, '
+                     'peak rss: {:.0f}MB]'.format(os.path.basename(file_path), mmap, dtype, tuple(feat.shape),
+                                                  time() - start, cur_rss, peak_rss))
+    return feat
+
+
+def permuted_feature_file(file_path, perm, cache_root):
+    r"""A ``.npy`` copy of a feature table with its rows in ``perm`` order, written once under ``cache_root``
+    (keyed by the file content and the permutation) so the relabeled table can still be memory-mapped.
+
+    Returns:
+        str: path of the permuted ``.npy`` file
+    """
+    start = time()
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    key = config_digest(file_digest(file_path), array_digest(perm))
+    cache_dir = os.path.join(cache_root, '{}-{}'.format(name, key[:16]))
+    cache_file = os.path.join(cache_dir, name + '.npy')
+    if not os.path.isfile(cache_file):
+        save_permuted_rows(cache_dir, name, np.load(file_path, mmap_mode='r'), perm, meta={'source': file_path})
+        getLogger().info('permuted feature cache built at {} [time: {:.2f}s]'.format(cache_dir, time() - start))
+    return cache_file
 
 
 class AbstractRecommender(nn.Module):
@@ -50,6 +114,29 @@ class AbstractRecommender(nn.Module):
             shape: [n_batch_users * n_candidate_items]
         """
         raise NotImplementedError
+
+    def close(self):
+        r"""Release resources held outside the module (worker processes, shared memory) once the model is done.
+        """
+        pass
+
+    def inference_embeddings(self, pin=False):
+        r"""Embeddings scored by :meth:`full_sort_predict`. Models that keep them across eval batches build them
+        here, so the valid and test passes of one eval step can share a single pass.
+
+        Args:
+            pin (bool): keep them for :meth:`full_sort_predict` until :meth:`release_inference_embeddings`,
+                whatever the model's own caching options say
+
+        Returns:
+            None if the model has nothing to precompute.
+        """
+        return None
+
+    def release_inference_embeddings(self):
+        r"""Free what :meth:`inference_embeddings` kept, once an evaluation is done with it.
+        """
+        pass
     #
     # def __str__(self):
     #     """
@@ -93,11 +180,23 @@ class GeneralRecommender(AbstractRecommender):
             # if file exist?
             v_feat_file_path = os.path.join(dataset_path, config['vision_feature_file'])
             t_feat_file_path = os.path.join(dataset_path, config['text_feature_file'])
+            feat_mmap, feat_dtype = bool(config['feat_mmap']), config['feat_dtype'] or 'float32'
+            # feature rows follow the relabeled item ids: memory-mapped tables are permuted once on disk,
+            # in-memory ones after loading
+            item_perm = dataloader.dataset.item_perm
+            if feat_mmap and item_perm is not None:
+                cache_root = os.path.join(dataset_path, config['cache_dir'] or 'cache')
+                v_feat_file_path, t_feat_file_path = [
+                    permuted_feature_file(f, item_perm, cache_root) if os.path.isfile(f) else f
+                    for f in (v_feat_file_path, t_feat_file_path)]
+                item_perm = None
             if os.path.isfile(v_feat_file_path):
-                self.v_feat = torch.from_numpy(np.load(v_feat_file_path, allow_pickle=True)).type(torch.FloatTensor).to(
-                    self.device)
+                self.v_feat = load_feature(v_feat_file_path, feat_mmap, feat_dtype).to(self.device)
             if os.path.isfile(t_feat_file_path):
-                self.t_feat = torch.from_numpy(np.load(t_feat_file_path, allow_pickle=True)).type(torch.FloatTensor).to(
-                    self.device)
+                self.t_feat = load_feature(t_feat_file_path, feat_mmap, feat_dtype).to(self.device)
 
             assert self.v_feat is not None or self.t_feat is not None, 'Features all NONE'
+            if item_perm is not None:
+                item_perm = torch.from_numpy(item_perm).to(self.device)
+                self.v_feat = self.v_feat[item_perm] if self.v_feat is not None else None
+                self.t_feat = self.t_feat[item_perm] if self.t_feat is not None else None
@@ -0,0 +1,393 @@
+# coding: utf-8
+"""
+Normalized user-item graph construction
+################################################
+"""
+import os
+from time import time
+from logging import getLogger
+
+import numpy as np
+import scipy.sparse as sp
+import torch
+
+from utils.cache_utils import array_digest, config_digest, save_arrays, load_arrays
+
+
+ADJ_FORMATS = ('coo', 'csr', 'csr32')
+VALUE_DTYPES = {'float32': torch.float32, 'float16': torch.float16, 'bfloat16': torch.bfloat16}
+
+
+class PropagationMatrix(object):
+    r"""A sparse matrix multiplied with dense embeddings, stored in a selectable layout.
+
+    ``coo`` keeps (2, nnz) int64 indices, marked coalesced so ``torch.sparse.mm`` does not sort them on every call;
+    ``csr`` keeps int64 row offsets and column indices and ``csr32`` the same as int32. Values can be kept in
+    ``float16``/``bfloat16``; each product then upcasts them ``chunk_rows`` rows at a time and multiplies the chunks
+    as float32 CSR, so accumulation stays in float32 and the float32 copy is one chunk, at the cost of speed.
+
+    Args:
+        indices (np.ndarray): (2, nnz) row/column indices in row-major order
+        values (np.ndarray): nnz values
+        shape (tuple): (n_rows, n_cols)
+        fmt (str): one of :data:`ADJ_FORMATS`
+        value_dtype (str): one of :data:`VALUE_DTYPES`
+        chunk_rows (int): rows upcast and multiplied at a time with 16-bit values
+    """
+    def __init__(self, indices, values, shape, fmt='coo', value_dtype='float32', chunk_rows=65536):
+        if fmt not in ADJ_FORMATS:
+            raise ValueError('adj_format [{}] should be one of {}'.format(fmt, ADJ_FORMATS))
+        if value_dtype not in VALUE_DTYPES:
+            raise ValueError('adj_value_dtype [{}] should be one of {}'.format(value_dtype, list(VALUE_DTYPES)))
+        self.fmt = fmt
+        self.shape = torch.Size(shape)
+        self.chunk_rows = max(int(chunk_rows), 1)
+        indices = torch.from_numpy(np.ascontiguousarray(indices, dtype=np.int64))
+        crow = torch.zeros(self.shape[0] + 1, dtype=torch.int64)
+        crow[1:] = torch.cumsum(torch.bincount(indices[0], minlength=self.shape[0]), dim=0)
+        if fmt == 'coo':
+            self.index = (indices,)
+        else:
+            index_dtype = torch.int32 if fmt == 'csr32' else torch.int64
+            self.index = (crow.to(index_dtype), indices[1].to(index_dtype))
+        self.values = torch.from_numpy(np.ascontiguousarray(values, dtype=np.float32)).to(VALUE_DTYPES[value_dtype])
+        # row offsets of the chunked 16-bit product; the csr formats already hold them
+        self._crow = None
+        if value_dtype != 'float32':
+            self._crow = crow if fmt == 'coo' else self.index[0]
+        self._build()
+
+    def _build(self):
+        # 16-bit values are never upcast as a whole, see _chunk
+        self._mat = None
+        if self.values.dtype != torch.float32:
+            return
+        if self.fmt == 'coo':
+            self._mat = torch.sparse_coo_tensor(self.index[0], self.values, self.shape)._coalesced_(True)
+        else:
+            self._mat = torch.sparse_csr_tensor(self.index[0], self.index[1], self.values, self.shape)
+
+    def _chunk(self, start, end):
+        """Rows ``start:end`` as a float32 CSR tensor, its columns viewed from the stored indices.
+        """
+        lo, hi = int(self._crow[start]), int(self._crow[end])
+        col = self.index[0][1, lo: hi] if self.fmt == 'coo' else self.index[1][lo: hi]
+        crow = (self._crow[start: end + 1] - lo).to(col.dtype)
+        return torch.sparse_csr_tensor(crow, col, self.values[lo: hi].float(), (end - start, self.shape[1]))
+
+    def to(self, device):
+        self.index = tuple(t.to(device) for t in self.index)
+        self.values = self.values.to(device)
+        if self._crow is not None:
+            self._crow = self._crow.to(device) if self.fmt == 'coo' else self.index[0]
+        self._build()
+        return self
+
+    def mm(self, x):
+        if self._mat is not None:
+            return torch.sparse.mm(self._mat, x)
+        return torch.cat([torch.sparse.mm(self._chunk(start, min(start + self.chunk_rows, self.shape[0])), x)
+                          for start in range(0, self.shape[0], self.chunk_rows)])
+
+    @property
+    def nnz(self):
+        return self.values.nelement()
+
+    def nbytes(self):
+        extra = (self._crow,) if self._crow is not None and self.fmt == 'coo' else ()
+        return sum(t.element_size() * t.nelement() for t in self.index + (self.values,) + extra)
+
+
+class SpmmFunction(torch.autograd.Function):
+    r"""``mat @ x`` for matrices that multiply outside of torch's sparse kernels (in chunks, in worker processes),
+    through their ``spmm(x, transpose=False)``; the gradient to ``x`` is ``mat.T @ grad``.
+    """
+    @staticmethod
+    def forward(ctx, x, mat):
+        ctx.mat = mat
+        return mat.spmm(x)
+
+    @staticmethod
+    def backward(ctx, grad):
+        return ctx.mat.spmm(grad, transpose=True), None
+
+
+class MmapPropagationMatrix(object):
+    r"""A CSR matrix kept in memory-mapped ``.npy`` files, multiplied with dense embeddings in row chunks.
+
+    Only one chunk of ``chunk_rows`` rows is read into memory (as an int64/float32 CSR tensor) at a time, so the
+    working memory is bounded by the chunk's nnz; the files stay in the page cache as far as RAM allows. Every
+    output row is computed from its own CSR row, so the result equals the in-memory ``csr`` product.
+
+    Args:
+        indptr (np.ndarray): int64 row offsets, typically memory-mapped
+        indices (np.ndarray): int32 column indices
+        values (np.ndarray): float32 values
+        shape (tuple): (n_rows, n_cols)
+        chunk_rows (int): rows multiplied at a time
+        symmetric (bool): the matrix equals its transpose, so the backward pass reuses the row chunks
+    """
+    fmt = 'mmap'
+
+    def __init__(self, indptr, indices, values, shape, chunk_rows=65536, symmetric=False):
+        self.indptr, self.indices, self.values = indptr, indices, values
+        self.shape = torch.Size(shape)
+        self.chunk_rows = max(int(chunk_rows), 1)
+        self.symmetric = symmetric
+
+    def to(self, device):
+        if torch.device(device).type != 'cpu':
+            raise ValueError('a memory-mapped adjacency is multiplied on the cpu only')
+        return self
+
+    def _chunk(self, start, end):
+        """Rows ``start:end`` as in-memory (int64 row offsets, int64 columns, float32 values).
+        """
+        lo, hi = int(self.indptr[start]), int(self.indptr[end])
+        crow = torch.from_numpy(np.asarray(self.indptr[start: end + 1], dtype=np.int64) - lo)
+        col = torch.from_numpy(np.asarray(self.indices[lo: hi], dtype=np.int64))
+        val = torch.from_numpy(np.array(self.values[lo: hi], dtype=np.float32))
+        return crow, col, val
+
+    def spmm(self, x, transpose=False):
+        if transpose and not self.symmetric:
+            # scatter every chunk's transpose into the (n_cols, d) result
+            out = x.new_zeros((self.shape[1], x.shape[1]))
+            for start in range(0, self.shape[0], self.chunk_rows):
+                end = min(start + self.chunk_rows, self.shape[0])
+                crow, col, val = self._chunk(start, end)
+                row = torch.repeat_interleave(torch.arange(end - start), crow[1:] - crow[:-1])
+                chunk_t = torch.sparse_coo_tensor(torch.stack([col, row]), val, (self.shape[1], end - start))
+                out += torch.sparse.mm(chunk_t, x[start: end])
+            return out
+        out = x.new_empty((self.shape[0], x.shape[1]))
+        for start in range(0, self.shape[0], self.chunk_rows):
+            end = min(start + self.chunk_rows, self.shape[0])
+            crow, col, val = self._chunk(start, end)
+            out[start: end] = torch.sparse.mm(torch.sparse_csr_tensor(crow, col, val, (end - start, self.shape[1])),
+                                              x)
+        return out
+
+    def mm(self, x):
+        return SpmmFunction.apply(x, self)
+
+    @property
+    def nnz(self):
+        return len(self.values)
+
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + self.values.nbytes
+
+
+def norm_bi_adj_arrays(users, items, n_users, n_items):
+    r"""User->item block ``R`` of the symmetrically normalized adjacency, built straight from edge arrays.
+
+    Degrees are counted over the distinct interactions with ``np.bincount`` and every value is
+    ``d_u^-1/2 * d_i^-1/2``. Entries come out in row-major order, as from a CSR matrix.
+
+    Args:
+        users (np.ndarray): user id of every interaction
+        items (np.ndarray): item id of every interaction
+        n_users (int): number of users
+        n_items (int): number of items
+
+    Returns:
+        (np.ndarray, np.ndarray): (2, nnz) int64 (user, item) indices and float32 values.
+    """
+    users = np.asarray(users, dtype=np.int64)
+    items = np.asarray(items, dtype=np.int64)
+    # distinct edges, sorted by user then item
+    edges = np.unique(users * n_items + items)
+    users, items = edges // n_items, edges % n_items
+    # add epsilon to avoid Devide by zero Warning
+    d_u = np.power(np.bincount(users, minlength=n_users) + 1e-7, -0.5)
+    d_i = np.power(np.bincount(items, minlength=n_items) + 1e-7, -0.5)
+    values = (d_u[users] * d_i[items]).astype(np.float32)
+    return np.stack([users, items]), values
+
+
+def transpose_arrays(indices, values):
+    r"""Transpose of a row-major (indices, values) pair, again in row-major order.
+    """
+    order = np.lexsort((indices[0], indices[1]))
+    return indices[::-1, order], values[order]
+
+
+def norm_adj_arrays(users, items, n_users, n_items):
+    r"""Symmetrically normalized bipartite adjacency :math:`D^{-1/2} A D^{-1/2}` built straight from edge arrays.
+
+    ``A`` has the edges ``(u, n_users + i)`` and ``(n_users + i, u)`` of every distinct interaction, i.e. the
+    blocks ``R`` of :func:`norm_bi_adj_arrays` and its transpose. Entries come out in row-major order.
+
+    Returns:
+        (np.ndarray, np.ndarray): (2, nnz) int64 indices and float32 values.
+    """
+    r_indices, r_values = norm_bi_adj_arrays(users, items, n_users, n_items)
+    return _symmetric_arrays(r_indices, r_values, n_users)
+
+
+def _symmetric_arrays(r_indices, r_values, n_users):
+    offset = np.array([[0], [n_users]], dtype=np.int64)
+    t_indices, t_values = transpose_arrays(r_indices, r_values)
+    return (np.concatenate([r_indices + offset, t_indices + offset[::-1]], axis=1),
+            np.concatenate([r_values, t_values]))
+
+
+def _cached_arrays(cache_root, name, key_parts, build):
+    """``build()`` -> (indices, values), stored under ``cache_root`` keyed by ``key_parts`` when it is given.
+    """
+    if cache_root is None:
+        return build()
+    start = time()
+    key = config_digest(name, *key_parts)
+    cache_dir = os.path.join(cache_root, '{}-{}'.format(name, key[:16]))
+    arrays, _ = load_arrays(cache_dir, ['indices', 'values'], mmap_mode=None)
+    if arrays is None:
+        indices, values = build()
+        save_arrays(cache_dir, {'indices': indices, 'values': values}, meta={'nnz': int(len(values))})
+        getLogger().info('{} cache built at {} [time: {:.2f}s]'.format(name, cache_dir, time() - start))
+        return indices, values
+    getLogger().info('{} cache hit at {} [time: {:.2f}s]'.format(name, cache_dir, time() - start))
+    return arrays['indices'], arrays['values']
+
+
+def _interactions_key(users, items, n_users, n_items):
+    return array_digest(np.asarray(users, dtype=np.int64), np.asarray(items, dtype=np.int64)), n_users, n_items
+
+
+def cached_norm_adj_arrays(users, items, n_users, n_items, cache_root=None):
+    r"""(indices, values) of the full normalized adjacency, assembled from the ``R`` block cached by
+    :func:`load_norm_adj` under ``cache_root`` (when given).
+    """
+    r_indices, r_values = _cached_arrays(cache_root, 'norm_bi_adj', _interactions_key(users, items, n_users, n_items),
+                                         lambda: norm_bi_adj_arrays(users, items, n_users, n_items))
+    return _symmetric_arrays(r_indices, r_values, n_users)
+
+
+def load_norm_adj(users, items, n_users, n_items, cache_root=None, fmt='coo', value_dtype='float32',
+                  bipartite=False):
+    r"""Normalized adjacency of the training interactions, optionally cached on disk.
+
+    Only the user->item block ``R`` is computed (and cached); the full symmetric matrix or ``R`` and its transpose
+    are assembled from it. With ``cache_root`` the block is stored under it, keyed by a fingerprint of the
+    interactions and the graph size, and loaded from there by later runs on the same training split.
+
+    Args:
+        bipartite (bool): return the blocks ``R`` and ``R^T`` instead of the full matrix; ``R^T`` is kept in a
+            CSR layout (``csr`` when ``fmt`` is ``coo``)
+
+    Returns:
+        PropagationMatrix: (n_users + n_items, n_users + n_items) adjacency in layout ``fmt``, or
+        (PropagationMatrix, PropagationMatrix): ``R`` (n_users, n_items) and ``R^T`` (n_items, n_users)
+    """
+    r_indices, r_values = _cached_arrays(cache_root, 'norm_bi_adj', _interactions_key(users, items, n_users, n_items),
+                                         lambda: norm_bi_adj_arrays(users, items, n_users, n_items))
+    if bipartite:
+        t_indices, t_values = transpose_arrays(r_indices, r_values)
+        return (PropagationMatrix(r_indices, r_values, (n_users, n_items), fmt, value_dtype),
+                PropagationMatrix(t_indices, t_values, (n_items, n_users), 'csr' if fmt == 'coo' else fmt,
+                                  value_dtype))
+    n_nodes = n_users + n_items
+    indices, values = _symmetric_arrays(r_indices, r_values, n_users)
+    return PropagationMatrix(indices, values, (n_nodes, n_nodes), fmt, value_dtype)
+
+
+def load_mmap_norm_adj(users, items, n_users, n_items, cache_root, chunk_rows=65536):
+    r"""Normalized adjacency as memory-mapped CSR files under ``cache_root``, written on the first run.
+
+    The files are keyed by a fingerprint of the interactions and the graph size, like the in-memory cache.
+
+    Returns:
+        MmapPropagationMatrix: (n_users + n_items, n_users + n_items) adjacency
+    """
+    start = time()
+    n_nodes = n_users + n_items
+    key = config_digest('norm_adj_csr', *_interactions_key(users, items, n_users, n_items))
+    cache_dir = os.path.join(cache_root, 'norm_adj_csr-{}'.format(key[:16]))
+    names = ['indptr', 'indices', 'values']
+    arrays, _ = load_arrays(cache_dir, names)
+    if arrays is None:
+        indices, values = _symmetric_arrays(*norm_bi_adj_arrays(users, items, n_users, n_items), n_users)
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(indices[0], minlength=n_nodes), out=indptr[1:])
+        save_arrays(cache_dir, {'indptr': indptr, 'indices': indices[1].astype(np.int32), 'values': values},
+                    meta={'n_users': int(n_users), 'n_items': int(n_items), 'nnz': int(len(values))})
+        del indices, values, indptr
+        arrays, _ = load_arrays(cache_dir, names)
+        getLogger().info('mmap norm adj written at {} [time: {:.2f}s]'.format(cache_dir, time() - start))
+    return MmapPropagationMatrix(arrays['indptr'], arrays['indices'], arrays['values'], (n_nodes, n_nodes),
+                                 chunk_rows=chunk_rows, symmetric=True)
+
+
+def propagation_operator_arrays(indices, values, n_nodes, n_layers, threshold=0.0, topk=0, block_rows=4096):
+    r"""The multi-layer LightGCN propagation as one operator :math:`P = mean(I, \hat{A}, ..., \hat{A}^L)`.
+
+    Computed in blocks of ``block_rows`` rows, ``P[block] = mean_k(I[block] \hat{A}^k)`` in float64, so at most one
+    block of the powers is held besides the result.
+
+    Args:
+        indices (np.ndarray): (2, nnz) indices of the normalized adjacency
+        values (np.ndarray): its values
+        n_nodes (int): number of graph nodes
+        n_layers (int): number of propagation layers ``L``
+        threshold (float): drop entries below it, from every power of a block and from ``P``
+        topk (int): if > 0, keep only the ``topk`` largest entries of every row of ``P`` (ties broken by column)
+        block_rows (int): rows computed at a time
+
+    Returns:
+        (np.ndarray, np.ndarray): (2, nnz) int64 indices of ``P`` in row-major order and float32 values.
+    """
+    adj = sp.csr_matrix((np.asarray(values, dtype=np.float64), (indices[0], indices[1])), shape=(n_nodes, n_nodes))
+    all_indices, all_values = [np.zeros((2, 0), dtype=np.int64)], [np.zeros(0, dtype=np.float32)]
+    for start in range(0, n_nodes, block_rows):
+        end = min(start + block_rows, n_nodes)
+        power = sp.csr_matrix((np.ones(end - start), (np.arange(end - start), np.arange(start, end))),
+                              shape=(end - start, n_nodes))
+        acc = power.copy()
+        for _ in range(n_layers):
+            power = power @ adj
+            if threshold > 0:
+                power.data[np.abs(power.data) < threshold] = 0
+                power.eliminate_zeros()
+            acc = acc + power
+        acc = (acc / (n_layers + 1)).tocoo()
+        r, c, d = acc.row.astype(np.int64) + start, acc.col.astype(np.int64), acc.data
+        keep = np.abs(d) >= threshold
+        r, c, d = r[keep], c[keep], d[keep]
+        order = np.lexsort((c, -np.abs(d), r)) if topk > 0 else np.lexsort((c, r))
+        r, c, d = r[order], c[order], d[order]
+        if topk > 0:
+            rank = np.arange(len(r)) - np.searchsorted(r, r, side='left')
+            r, c, d = r[rank < topk], c[rank < topk], d[rank < topk]
+            order = np.lexsort((c, r))
+            r, c, d = r[order], c[order], d[order]
+        all_indices.append(np.stack([r, c]))
+        all_values.append(d.astype(np.float32))
+    return np.concatenate(all_indices, axis=1), np.concatenate(all_values)
+
+
+def load_propagation_operator(users, items, n_users, n_items, n_layers, threshold=0.0, topk=0, cache_root=None,
+                              fmt='coo', value_dtype='float32'):
+    r"""Precomputed propagation operator of the training interactions, optionally cached on disk.
+
+    With ``cache_root`` it is stored under it, keyed by a fingerprint of the interactions, the graph size,
+    ``n_layers`` and the pruning settings. Logs the fill-in of ``P`` against the adjacency.
+
+    Returns:
+        PropagationMatrix: (n_users + n_items, n_users + n_items) operator ``P`` in layout ``fmt``
+    """
+    n_nodes = n_users + n_items
+    key = _interactions_key(users, items, n_users, n_items)
+    adj_indices, adj_values = cached_norm_adj_arrays(users, items, n_users, n_items, cache_root)
+
+    def build():
+        start = time()
+        ret = propagation_operator_arrays(adj_indices, adj_values, n_nodes, n_layers, threshold, topk)
+        getLogger().info('propagation operator built [layers: {}, threshold: {}, topk: {}, time: {:.2f}s]'.format(
+            n_layers, threshold, topk, time() - start))
+        return ret
+
+    indices, values = _cached_arrays(cache_root, 'prop_op', key + (n_layers, float(threshold), int(topk)), build)
+    getLogger().info('propagation operator fill-in [nnz: {}, adjacency nnz: {}, x{:.2f}, density: {:.4%}]'.format(
+        len(values), len(adj_values), len(values) / max(len(adj_values), 1), len(values) / float(n_nodes) ** 2))
+    return PropagationMatrix(indices, values, (n_nodes, n_nodes), fmt, value_dtype)
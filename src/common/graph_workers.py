@@ -0,0 +1,140 @@
+# coding: utf-8
+"""
+Multi-process partitioned graph propagation on the cpu
+################################################
+"""
+import weakref
+from time import time
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from common.graph import SpmmFunction, cached_norm_adj_arrays
+
+
+def _partition_rows(indptr, n_parts):
+    """Row boundaries splitting the matrix into ``n_parts`` blocks of about the same nnz.
+    """
+    bounds = np.searchsorted(indptr, np.linspace(0, indptr[-1], n_parts + 1), side='left')
+    bounds[0], bounds[-1] = 0, len(indptr) - 1
+    return np.maximum.accumulate(bounds)
+
+
+def _propagate_worker(rank, lo, hi, n_threads, shared, task_queue, done_queue):
+    """Multiply rows ``lo:hi`` of the shared CSR matrix with the shared input into the shared output, once per
+    task, until ``None`` arrives.
+    """
+    torch.set_num_threads(n_threads)
+    indptr, x, out = shared['indptr'], shared['x'], shared['out']
+    start, end = int(indptr[lo]), int(indptr[hi])
+    block = torch.sparse_csr_tensor((indptr[lo: hi + 1] - start).int(), shared['indices'][start: end],
+                                    shared['values'][start: end], (hi - lo, x.shape[0]))
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        begin = time()
+        out[lo: hi] = torch.sparse.mm(block, x)
+        done_queue.put((rank, time() - begin))
+
+
+def _stop_workers(task_queues, workers):
+    for q in task_queues:
+        q.put(None)
+    for p in workers:
+        # a freshly spawned worker may still be importing torch before it reads the stop signal
+        p.join(timeout=10)
+        if p.is_alive():
+            p.terminate()
+            p.join()
+    del workers[:]
+
+
+class PartitionedPropagationMatrix(object):
+    r"""A symmetric CSR matrix split into row blocks of about equal nnz, multiplied by worker processes.
+
+    The matrix, the input embeddings and the output live in torch shared memory; for every product the input is
+    copied in, each worker writes the rows of its block and the output is copied out. Every output row is computed
+    from its own CSR row, so the result equals the single-process ``csr`` product.
+
+    Args:
+        indices (np.ndarray): (2, nnz) row/column indices in row-major order
+        values (np.ndarray): nnz values
+        n_nodes (int): number of rows and columns
+        dim (int): embedding size of the products
+        n_workers (int): worker processes, each owning one row block
+        threads_per_worker (int): torch threads of each worker (default: the cpu threads split evenly)
+    """
+    fmt = 'partitioned'
+
+    def __init__(self, indices, values, n_nodes, dim, n_workers, threads_per_worker=None):
+        self.shape = torch.Size((n_nodes, n_nodes))
+        self.n_workers = n_workers
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(indices[0], minlength=n_nodes), out=indptr[1:])
+        self.bounds = _partition_rows(indptr, n_workers)
+        self.shared = {'indptr': torch.from_numpy(indptr).share_memory_(),
+                       'indices': torch.from_numpy(np.asarray(indices[1], dtype=np.int32)).share_memory_(),
+                       'values': torch.from_numpy(np.asarray(values, dtype=np.float32)).share_memory_(),
+                       'x': torch.zeros((n_nodes, dim)).share_memory_(),
+                       'out': torch.zeros((n_nodes, dim)).share_memory_()}
+        n_threads = threads_per_worker or max(torch.get_num_threads() // n_workers, 1)
+        # spawned, not forked: a fork of a parent whose OpenMP pool is already running can deadlock in the child
+        ctx = mp.get_context('spawn')
+        self.task_queues = [ctx.Queue() for _ in range(n_workers)]
+        self.done_queue = ctx.Queue()
+        self.workers = []
+        for w in range(n_workers):
+            p = ctx.Process(target=_propagate_worker, args=(w, int(self.bounds[w]), int(self.bounds[w + 1]),
+                                                            n_threads, self.shared, self.task_queues[w],
+                                                            self.done_queue), daemon=True)
+            p.start()
+            self.workers.append(p)
+        # the workers stop on close() or, at the latest, when the matrix is garbage collected
+        self._finalizer = weakref.finalize(self, _stop_workers, self.task_queues, self.workers)
+        self.values = self.shared['values']
+        self.busy = np.zeros(n_workers)
+        self.n_calls = 0
+
+    def to(self, device):
+        if torch.device(device).type != 'cpu':
+            raise ValueError('partitioned propagation runs on the cpu only')
+        return self
+
+    def spmm(self, x, transpose=False):
+        # symmetric: the transposed product is the product
+        if x.shape != self.shared['x'].shape:
+            raise ValueError('input of shape {} expected, got {}'.format(tuple(self.shared['x'].shape),
+                                                                         tuple(x.shape)))
+        self.shared['x'].copy_(x)
+        for q in self.task_queues:
+            q.put(1)
+        for _ in range(self.n_workers):
+            rank, busy = self.done_queue.get()
+            self.busy[rank] += busy
+        self.n_calls += 1
+        return self.shared['out'].clone()
+
+    def mm(self, x):
+        return SpmmFunction.apply(x, self)
+
+    @property
+    def nnz(self):
+        return len(self.values)
+
+    def nbytes(self):
+        return sum(self.shared[k].element_size() * self.shared[k].nelement() for k in ['indptr', 'indices', 'values'])
+
+    def close(self):
+        self._finalizer()
+
+
+def load_partitioned_norm_adj(users, items, n_users, n_items, dim, n_workers, cache_root=None):
+    r"""Normalized adjacency of the training interactions, propagated by ``n_workers`` processes.
+
+    Returns:
+        PartitionedPropagationMatrix: (n_users + n_items, n_users + n_items) adjacency
+    """
+    indices, values = cached_norm_adj_arrays(users, items, n_users, n_items, cache_root)
+    return PartitionedPropagationMatrix(indices, values, n_users + n_items, dim, n_workers)
@@ -8,6 +8,7 @@ r"""
 import os
 import itertools
 import torch
+import torch.nn as nn
 import torch.optim as optim
 from torch.nn.utils.clip_grad import clip_grad_norm_
 import numpy as np
@@ -15,6 +16,7 @@ import matplotlib.pyplot as plt
 
 from time import time
 from logging import getLogger
+from concurrent.futures import ThreadPoolExecutor
 
 from utils.utils import get_local_time, early_stopping, dict2str
 from utils.topk_evaluator import TopKEvaluator
@@ -44,6 +46,43 @@ class AbstractTrainer(object):
         raise NotImplementedError('Method [next] should be implemented.')
 
 
+class MultiOptimizer(optim.Optimizer):
+    r"""Several optimizers stepped as one, e.g. Adam for the dense parameters next to SparseAdam for the
+    sparse-gradient embeddings, so lr schedulers and checkpoints still see a single optimizer. The parameter groups
+    are the children's own group dicts, so a scheduler setting their lr reaches every child.
+    """
+
+    def __init__(self, optimizers):
+        # Optimizer.__init__ sets up hooks and profiling; it copies the groups, which are then swapped for the
+        # children's own dicts, since groups and state belong to the children
+        super(MultiOptimizer, self).__init__(
+            [{'params': group['params']} for optimizer in optimizers for group in optimizer.param_groups],
+            optimizers[0].defaults)
+        self.optimizers = optimizers
+        self.param_groups = [group for optimizer in optimizers for group in optimizer.param_groups]
+
+    def zero_grad(self, *args, **kwargs):
+        for optimizer in self.optimizers:
+            optimizer.zero_grad(*args, **kwargs)
+
+    def step(self, closure=None):
+        # the closure re-evaluates the loss once for all children
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+        for optimizer in self.optimizers:
+            optimizer.step()
+        return loss
+
+    def state_dict(self):
+        return {'optimizers': [optimizer.state_dict() for optimizer in self.optimizers]}
+
+    def load_state_dict(self, state_dict):
+        for optimizer, state in zip(self.optimizers, state_dict['optimizers']):
+            optimizer.load_state_dict(state)
+
+
 class Trainer(AbstractTrainer):
     r"""The basic Trainer for basic training and evaluation strategies in recommender systems. This class defines common
     functions for training and evaluation processes of most recommender system models, including fit(), evaluate(),
@@ -73,6 +112,10 @@ class Trainer(AbstractTrainer):
         self.valid_metric_bigger = config['valid_metric_bigger']
         self.test_batch_size = config['eval_batch_size']
         self.device = config['device']
+        self.eval_shared_pass = bool(config['eval_shared_pass'])
+        self.eval_parallel = bool(config['eval_parallel'])
+        # set while a shared eval step still needs the model's inference embeddings after one loader is scored
+        self._keep_inference_embeddings = False
 
         self.start_epoch = 0
         self.cur_step = 0
@@ -111,17 +154,27 @@ class Trainer(AbstractTrainer):
         Returns:
             torch.optim: the optimizer
         """
+        # embeddings with sparse gradients are stepped lazily (touched rows only) by SparseAdam
+        sparse_params = [p for m in self.model.modules() if isinstance(m, nn.Embedding) and m.sparse
+                         for p in m.parameters() if p.requires_grad]
+        sparse_ids = set(id(p) for p in sparse_params)
+        # frozen parameters (e.g. fixed feature tables) never reach the optimizer
+        params = [p for p in self.model.parameters() if p.requires_grad and id(p) not in sparse_ids]
         if self.learner.lower() == 'adam':
-            optimizer = optim.Adam(self.model.parameters(), lr=self.learning_rate)
+            optimizer = optim.Adam(params, lr=self.learning_rate)
         elif self.learner.lower() == 'sgd':
-            optimizer = optim.SGD(self.model.parameters(), lr=self.learning_rate)
+            optimizer = optim.SGD(params, lr=self.learning_rate)
         elif self.learner.lower() == 'adagrad':
-            optimizer = optim.Adagrad(self.model.parameters(), lr=self.learning_rate)
+            optimizer = optim.Adagrad(params, lr=self.learning_rate)
         elif self.learner.lower() == 'rmsprop':
-            optimizer = optim.RMSprop(self.model.parameters(), lr=self.learning_rate)
+            optimizer = optim.RMSprop(params, lr=self.learning_rate)
         else:
             self.logger.warning('Received unrecognized optimizer, set default Adam optimizer')
-            optimizer = optim.Adam(self.model.parameters(), lr=self.learning_rate)
+            optimizer = optim.Adam(params, lr=self.learning_rate)
+        if sparse_params:
+            self.logger.info('sparse-gradient parameters [tensors: {}, elements: {}] stepped by SparseAdam'.format(
+                len(sparse_params), sum(p.numel() for p in sparse_params)))
+            optimizer = MultiOptimizer([optimizer, optim.SparseAdam(sparse_params, lr=self.learning_rate)])
         return optimizer
 
     def _train_epoch(self, train_data, epoch_idx, loss_func=None):
@@ -179,6 +232,50 @@ class Trainer(AbstractTrainer):
         valid_score = valid_result[self.valid_metric] if self.valid_metric else valid_result['NDCG@20']
         return valid_score, valid_result
 
+    def _shared_valid_test(self, valid_data, test_data):
+        r"""Score the valid and test data against one pass of the model's inference embeddings.
+
+        Args:
+            valid_data (DataLoader): the valid data
+            test_data (DataLoader): the test data
+
+        Returns:
+            float: valid score
+            dict: valid result
+            dict: test result
+            tuple: seconds spent on the embeddings, the valid scoring, the test scoring and the scoring wall time
+        """
+        start = time()
+        self.model.eval()
+        with torch.no_grad():
+            # pinned: every eval batch of both loaders scores these, whatever the model's caching options
+            pinned = self.model.inference_embeddings(pin=True) is not None
+        embed_end = time()
+        self._keep_inference_embeddings = True
+        if self.eval_parallel and not pinned:
+            # the loaders would run the model's forward concurrently, which is not thread safe
+            self.logger.warning('eval_parallel needs a model keeping its inference embeddings, scoring sequentially')
+            self.eval_parallel = False
+
+        def timed(eval_data):
+            begin = time()
+            return self._valid_epoch(eval_data), time() - begin
+
+        try:
+            if self.eval_parallel:
+                # the embeddings are pinned by now, so both loaders only read them
+                with ThreadPoolExecutor(max_workers=2) as pool:
+                    valid_future, test_future = pool.submit(timed, valid_data), pool.submit(timed, test_data)
+                    (valid_score, valid_result), valid_time = valid_future.result()
+                    (_, test_result), test_time = test_future.result()
+            else:
+                (valid_score, valid_result), valid_time = timed(valid_data)
+                (_, test_result), test_time = timed(test_data)
+        finally:
+            self._keep_inference_embeddings = False
+            self.model.release_inference_embeddings()
+        return valid_score, valid_result, test_result, (embed_end - start, valid_time, test_time, time() - embed_end)
+
     def _check_nan(self, loss):
         if torch.isnan(loss):
             #raise ValueError('Training loss is nan')
@@ -262,7 +359,11 @@ class Trainer(AbstractTrainer):
             # eval: To ensure the test result is the best model under validation data, set self.eval_step == 1
             if (epoch_idx + 1) % self.eval_step == 0:
                 valid_start_time = time()
-                valid_score, valid_result = self._valid_epoch(valid_data)
+                if self.eval_shared_pass:
+                    valid_score, valid_result, test_result, eval_times = self._shared_valid_test(valid_data,
+                                                                                                 test_data)
+                else:
+                    valid_score, valid_result = self._valid_epoch(valid_data)
                 self.best_valid_score, self.cur_step, stop_flag, update_flag = early_stopping(
                     valid_score, self.best_valid_score, self.cur_step,
                     max_step=self.stopping_step, bigger=self.valid_metric_bigger)
@@ -271,9 +372,14 @@ class Trainer(AbstractTrainer):
                                      (epoch_idx, valid_end_time - valid_start_time, valid_score)
                 valid_result_output = 'valid result: \n' + dict2str(valid_result)
                 # test
-                _, test_result = self._valid_epoch(test_data)
+                if not self.eval_shared_pass:
+                    _, test_result = self._valid_epoch(test_data)
                 if verbose:
                     self.logger.info(valid_score_output)
+                    if self.eval_shared_pass:
+                        self.logger.info('epoch %d eval time [embeddings: %.2fs, valid: %.2fs, test: %.2fs, '
+                                         'scoring wall: %.2fs%s]' % ((epoch_idx,) + eval_times +
+                                                                     (', parallel' if self.eval_parallel else '',)))
                     self.logger.info(valid_result_output)
                     self.logger.info('test result: \n' + dict2str(test_result))
                 if update_flag:
@@ -310,10 +416,12 @@ class Trainer(AbstractTrainer):
             scores = self.model.full_sort_predict(batched_data)
             masked_items = batched_data[1]
             # mask out pos items
-            scores[masked_items[0], masked_items[1]] = -1e10
+            scores[masked_items[0].long(), masked_items[1].long()] = -1e10
             # rank and get top-k
             _, topk_index = torch.topk(scores, max(self.config['topk']), dim=-1)  # nusers x topk
             batch_matrix_list.append(topk_index)
+        if not self._keep_inference_embeddings:
+            self.model.release_inference_embeddings()
         return self.evaluator.evaluate(batch_matrix_list, eval_data, is_test=is_test, idx=idx)
 
     def plot_train_loss(self, show=True, save_path=None):
@@ -6,9 +6,10 @@ r"""
 """
 import os
 import copy
-import random
+from time import time
+from logging import getLogger
+from collections import namedtuple
 import numpy as np
-import scipy.sparse as sp
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -16,6 +17,11 @@ from torch.nn.functional import cosine_similarity
 
 from common.abstract_recommender import GeneralRecommender
 from common.loss import EmbLoss
+from common.graph import load_norm_adj, load_mmap_norm_adj, load_propagation_operator
+from common.graph_workers import load_partitioned_norm_adj
+
+# graph user/item embeddings and the projected text/image features (None when forward did not project them)
+BM3Output = namedtuple('BM3Output', ['user', 'item', 'text', 'image'])
 
 
 class BM3(GeneralRecommender):
@@ -43,7 +49,65 @@ class BM3(GeneralRecommender):
         self.n_nodes = self.n_users + self.n_items
 
         # load dataset info
-        self.norm_adj = self.get_norm_adj_mat(dataset.inter_matrix(form='coo').astype(np.float32)).to(self.device)
+        cache_root = None
+        if config['norm_adj_cache']:
+            cache_root = os.path.join(dataset.dataset.dataset_path, config['cache_dir'] or 'cache')
+        self.adj_mode = config['adj_mode'] or 'full'
+        # training propagation refreshed every k steps or per epoch, reusing the neighbor sums in between
+        self.history_refresh = config['history_refresh'] or 0
+        if self.history_refresh != 'epoch' and not (isinstance(self.history_refresh, int) and
+                                                    self.history_refresh >= 0):
+            raise ValueError('history_refresh [{}] should be a step count or epoch'.format(self.history_refresh))
+        self._history, self._history_steps = None, 0
+        self._history_stats = {'refreshes': 0, 'cached': 0}
+        self.layer_agg = config['layer_agg'] or 'stack'
+        if self.layer_agg not in ('stack', 'sum'):
+            raise ValueError('layer_agg [{}] should be one of stack, sum'.format(self.layer_agg))
+        if self.adj_mode not in ('full', 'bipartite'):
+            raise ValueError('adj_mode [{}] should be one of full, bipartite'.format(self.adj_mode))
+        fmt, value_dtype = config['adj_format'] or 'coo', config['adj_value_dtype'] or 'float32'
+        self.norm_adj, self.prop_op = None, None
+        if config['precompute_propagation']:
+            # the layers are linear: one product with P = mean(I, A, ..., A^L) replaces them
+            if self.adj_mode != 'full':
+                raise ValueError('precompute_propagation needs adj_mode full')
+            inter_M = dataset.inter_matrix(form='coo')
+            self.prop_op = load_propagation_operator(
+                inter_M.row, inter_M.col, self.n_users, self.n_items, self.n_layers,
+                threshold=config['prop_prune_threshold'] or 0.0, topk=config['prop_prune_topk'] or 0,
+                cache_root=cache_root, fmt=fmt, value_dtype=value_dtype).to(self.device)
+        elif config['adj_mmap']:
+            # CSR files under the dataset cache dir, multiplied in row chunks
+            if self.adj_mode != 'full':
+                raise ValueError('adj_mmap needs adj_mode full')
+            inter_M = dataset.inter_matrix(form='coo')
+            self.norm_adj = load_mmap_norm_adj(
+                inter_M.row, inter_M.col, self.n_users, self.n_items,
+                os.path.join(dataset.dataset.dataset_path, config['cache_dir'] or 'cache'),
+                chunk_rows=config['adj_chunk_rows'] or 65536).to(self.device)
+            getLogger().info('norm adj [shape: {}, format: mmap, nnz: {}, chunk rows: {}, on disk: {:.2f}MB]'.format(
+                tuple(self.norm_adj.shape), self.norm_adj.nnz, self.norm_adj.chunk_rows,
+                self.norm_adj.nbytes() / 1024.0 ** 2))
+        elif config['propagation_workers']:
+            # row blocks of the adjacency multiplied by worker processes over shared memory
+            if self.adj_mode != 'full':
+                raise ValueError('propagation_workers needs adj_mode full')
+            inter_M = dataset.inter_matrix(form='coo')
+            self.norm_adj = load_partitioned_norm_adj(
+                inter_M.row, inter_M.col, self.n_users, self.n_items, self.embedding_dim,
+                config['propagation_workers'], cache_root=cache_root).to(self.device)
+            getLogger().info('norm adj [shape: {}, format: partitioned, nnz: {}, workers: {}]'.format(
+                tuple(self.norm_adj.shape), self.norm_adj.nnz, self.norm_adj.n_workers))
+        elif self.adj_mode == 'bipartite':
+            # user->item block R and its transpose, the user-user/item-item blocks are empty
+            self.ui_adj, self.iu_adj = self.get_norm_adj_mat(
+                dataset.inter_matrix(form='coo').astype(np.float32), cache_root=cache_root, fmt=fmt,
+                value_dtype=value_dtype, bipartite=True)
+            self.ui_adj, self.iu_adj = self.ui_adj.to(self.device), self.iu_adj.to(self.device)
+        else:
+            self.norm_adj = self.get_norm_adj_mat(dataset.inter_matrix(form='coo').astype(np.float32),
+                                                  cache_root=cache_root, fmt=fmt,
+                                                  value_dtype=value_dtype).to(self.device)
 
         self.user_embedding = nn.Embedding(self.n_users, self.embedding_dim)
         self.item_id_embedding = nn.Embedding(self.n_items, self.embedding_dim)
@@ -52,31 +116,118 @@ class BM3(GeneralRecommender):
 
         self.predictor = nn.Linear(self.embedding_dim, self.embedding_dim)
         self.reg_loss = EmbLoss()
+        # projected user/item embeddings of the last full-sort pass, tagged with the parameter versions they used
+        self.eval_snapshot = bool(config['eval_snapshot'])
+        self.sliced_loss = bool(config['sliced_loss'])
+        self.sliced_reg = bool(config['sliced_reg'])
+        self._snapshot, self._snapshot_key = None, None
+        # set by a shared eval pass, which keeps the snapshot even with eval_snapshot off
+        self._snapshot_pinned = False
 
         nn.init.xavier_normal_(self.predictor.weight)
 
+        # 16-bit feature tables cannot take optimizer updates (Adam's eps underflows in float16): they are only
+        # accepted frozen, so that training the tables is never turned off behind the user's back
+        if config['feat_dtype'] not in (None, 'float32') and not config['freeze_features']:
+            raise ValueError('feat_dtype [{}] stores untrainable feature tables, set freeze_features: True or use '
+                             'float32'.format(config['feat_dtype']))
+        freeze_feat = bool(config['freeze_features'])
+
+        # raw feature tables read through embedding lookups, so their gradients are sparse over the rows read
+        self.feat_sparse_grad = bool(config['feat_sparse_grad'])
+        if self.feat_sparse_grad and (freeze_feat or not self.sliced_loss):
+            raise ValueError('feat_sparse_grad needs trainable float32 feature tables and sliced_loss')
+        # the multimodal item embedding reads every item row each step: the sparse gradient would cover the whole
+        # table (plus its indices) and only slow the step down
+        mm_on = self.mm_weight_learnable or (self.mm_weight is not None and self.mm_weight != 0)
+        if self.feat_sparse_grad and mm_on:
+            raise ValueError('feat_sparse_grad needs mm_weight 0 (and mm_weight_learnable off)')
+
         if self.v_feat is not None:
-            self.image_embedding = nn.Embedding.from_pretrained(self.v_feat, freeze=False)
+            self.image_embedding = nn.Embedding.from_pretrained(self.v_feat, freeze=freeze_feat,
+                                                                sparse=self.feat_sparse_grad)
             self.image_trs = nn.Linear(self.v_feat.shape[1], self.feat_embed_dim)
             nn.init.xavier_normal_(self.image_trs.weight)
         if self.t_feat is not None:
-            self.text_embedding = nn.Embedding.from_pretrained(self.t_feat, freeze=False)
+            self.text_embedding = nn.Embedding.from_pretrained(self.t_feat, freeze=freeze_feat,
+                                                               sparse=self.feat_sparse_grad)
             self.text_trs = nn.Linear(self.t_feat.shape[1], self.feat_embed_dim)
             nn.init.xavier_normal_(self.text_trs.weight)
+        if freeze_feat:
+            # only text_trs / image_trs train: no gradients, Adam moments or grad-wrt-table backward for the tables.
+            # fixed 16-bit tables are upcast to float32 once here instead of on every forward (float32 ones need not)
+            cache_bytes = 0
+            for name in ['image', 'text']:
+                embedding = getattr(self, name + '_embedding', None)
+                if embedding is not None and embedding.weight.dtype != torch.float32:
+                    self.register_buffer(name + '_feat32', embedding.weight.float(), persistent=False)
+                    cache_bytes += 4 * embedding.weight.nelement()
+            table_bytes = sum(f.element_size() * f.nelement() for f in (self.v_feat, self.t_feat) if f is not None)
+            getLogger().info('raw features frozen [tables: {:.2f}MB, float32 upcast cache: {:.2f}MB, gradient + '
+                             'optimizer state avoided: {:.2f}MB]'.format(table_bytes / 1024.0 ** 2,
+                                                                        cache_bytes / 1024.0 ** 2,
+                                                                        3 * table_bytes / 1024.0 ** 2))
+        # projections forward hands to the loss instead of the loss projecting again, summed over an epoch
+        self._proj_time = 0.0
+        self._proj_saved = {'steps': 0, 'flops': 0, 'time': 0.0}
+
+    def _raw_features(self, name, rows=None):
+        """float32 rows (all rows with None) of the ``'text'`` / ``'image'`` feature table, read from the upcast
+        cache when the tables are frozen.
+        """
+        cached = getattr(self, name + '_feat32', None)
+        if cached is not None:
+            return cached if rows is None else cached[rows]
+        embedding = getattr(self, name + '_embedding')
+        return (embedding.weight if rows is None else embedding(rows)).float()
 
-    def _compute_mm_item(self):
+    def _project_modalities(self):
         """
         Returns:
-            mm_item: (n_items, embedding_dim) or None
+            (t_proj, v_proj): (n_items, feat_embed_dim) projected text / image features, None without the modality
         """
-
+        start = time()
         t_proj, v_proj = None, None
-
         if self.t_feat is not None:
-            t_proj = self.text_trs(self.text_embedding.weight)
-
+            t_proj = self.text_trs(self._raw_features('text'))
         if self.v_feat is not None:
-            v_proj = self.image_trs(self.image_embedding.weight)
+            v_proj = self.image_trs(self._raw_features('image'))
+        self._proj_time = time() - start
+        return t_proj, v_proj
+
+    def _count_shared_projection(self, rows):
+        # forward matmul 2*rows*in*out, its backward twice that; the time is the measured forward share
+        flops = sum(2 * rows * trs.in_features * trs.out_features
+                    for trs in [getattr(self, 'text_trs', None), getattr(self, 'image_trs', None)] if trs is not None)
+        self._proj_saved['steps'] += 1
+        self._proj_saved['flops'] += 3 * flops
+        self._proj_saved['time'] += self._proj_time * rows / self.n_items
+
+    def close(self):
+        if self.norm_adj is not None and hasattr(self.norm_adj, 'close'):
+            self.norm_adj.close()
+
+    def pre_epoch_processing(self):
+        if self.history_refresh == 'epoch':
+            self._history = None
+
+    def post_epoch_processing(self):
+        info = []
+        saved, self._proj_saved = self._proj_saved, {'steps': 0, 'flops': 0, 'time': 0.0}
+        if saved['steps'] > 0:
+            info.append('modality projections shared with the loss [steps: {}, saved: {:.2f} GFLOP, forward time: '
+                        '{:.3f}s]'.format(saved['steps'], saved['flops'] / 1e9, saved['time']))
+        stats, self._history_stats = self._history_stats, {'refreshes': 0, 'cached': 0}
+        if self.history_refresh:
+            info.append('historical propagation [refreshes: {}, steps on cached neighbors: {}]'.format(
+                stats['refreshes'], stats['cached']))
+        return '\n'.join(info) if info else None
+
+    def _compute_mm_item(self, t_proj, v_proj):
+        """
+        Returns:
+            mm_item: (n_items, embedding_dim) or None
+        """
 
         if t_proj is None and v_proj is None:
             print("No multi-modal features available!")
@@ -99,46 +250,90 @@ class BM3(GeneralRecommender):
         mm_item = alpha_t * t_proj + alpha_v * v_proj
         return mm_item
 
-    def get_norm_adj_mat(self, interaction_matrix):
-        A = sp.dok_matrix((self.n_users + self.n_items,
-                           self.n_users + self.n_items), dtype=np.float32)
-        inter_M = interaction_matrix
-        inter_M_t = interaction_matrix.transpose()
-        data_dict = dict(zip(zip(inter_M.row, inter_M.col + self.n_users),
-                             [1] * inter_M.nnz))
-        data_dict.update(dict(zip(zip(inter_M_t.row + self.n_users, inter_M_t.col),
-                                  [1] * inter_M_t.nnz)))
-        A._update(data_dict)
-        # norm adj matrix
-        sumArr = (A > 0).sum(axis=1)
-        # add epsilon to avoid Devide by zero Warning
-        diag = np.array(sumArr.flatten())[0] + 1e-7
-        diag = np.power(diag, -0.5)
-        D = sp.diags(diag)
-        L = D * A * D
-        # covert norm_adj matrix to tensor
-        L = sp.coo_matrix(L)
-        row = L.row
-        col = L.col
-        i = torch.LongTensor(np.array([row, col]))
-        data = torch.FloatTensor(L.data)
-
-        return torch.sparse.FloatTensor(i, data, torch.Size((self.n_nodes, self.n_nodes)))
+    def get_norm_adj_mat(self, interaction_matrix, cache_root=None, fmt='coo', value_dtype='float32',
+                         bipartite=False):
+        adj = load_norm_adj(interaction_matrix.row, interaction_matrix.col, self.n_users, self.n_items,
+                            cache_root=cache_root, fmt=fmt, value_dtype=value_dtype, bipartite=bipartite)
+        for mat in (adj if bipartite else (adj,)):
+            getLogger().info('norm adj [shape: {}, format: {}, values: {}, nnz: {}, size: {:.2f}MB]'.format(
+                tuple(mat.shape), mat.fmt, mat.values.dtype, mat.nnz, mat.nbytes() / 1024.0 ** 2))
+        return adj
 
-    def forward(self):
-        h = self.item_id_embedding.weight
+    def _propagate(self):
+        """
+        Returns:
+            (u_g_embeddings, i_g_embeddings): mean of the layer-0..n_layers graph embeddings
+        """
+        if self.history_refresh and self.training:
+            return self._historical_propagate()
+        return self._exact_propagate()
+
+    def _historical_propagate(self):
+        r"""Training propagation on historical embeddings: on a refresh the graph is propagated exactly and the sum of
+        layers 1..n_layers is kept (detached); until the next refresh the output is the current layer 0 plus that sum,
+        so gradients reach the ego embeddings directly but not through the graph.
+        """
+        u_ego, i_ego = self.user_embedding.weight, self.item_id_embedding.weight
+        due = self.history_refresh != 'epoch' and self._history_steps >= self.history_refresh
+        if self._history is None or due:
+            u_g_embeddings, i_g_embeddings = self._exact_propagate()
+            with torch.no_grad():
+                self._history = (u_g_embeddings * (self.n_layers + 1) - u_ego,
+                                 i_g_embeddings * (self.n_layers + 1) - i_ego)
+            self._history_steps = 1
+            self._history_stats['refreshes'] += 1
+            return u_g_embeddings, i_g_embeddings
+        self._history_steps += 1
+        self._history_stats['cached'] += 1
+        return (u_ego + self._history[0]) / (self.n_layers + 1), (i_ego + self._history[1]) / (self.n_layers + 1)
+
+    def _exact_propagate(self):
+        if self.adj_mode == 'bipartite':
+            u_ego, i_ego = self.user_embedding.weight, self.item_id_embedding.weight
+            if self.layer_agg == 'sum':
+                u_sum, i_sum = u_ego, i_ego
+                for i in range(self.n_layers):
+                    u_ego, i_ego = self.ui_adj.mm(i_ego), self.iu_adj.mm(u_ego)
+                    u_sum, i_sum = u_sum + u_ego, i_sum + i_ego
+                return u_sum / (self.n_layers + 1), i_sum / (self.n_layers + 1)
+            all_u, all_i = [u_ego], [i_ego]
+            for i in range(self.n_layers):
+                u_ego, i_ego = self.ui_adj.mm(i_ego), self.iu_adj.mm(u_ego)
+                all_u += [u_ego]
+                all_i += [i_ego]
+            return torch.stack(all_u, dim=1).mean(dim=1), torch.stack(all_i, dim=1).mean(dim=1)
 
         ego_embeddings = torch.cat((self.user_embedding.weight, self.item_id_embedding.weight), dim=0)
+        if self.prop_op is not None:
+            return torch.split(self.prop_op.mm(ego_embeddings), [self.n_users, self.n_items], dim=0)
+        if self.layer_agg == 'sum':
+            # running sum: only the current layer and the sum are alive, no stacked copy
+            sum_embeddings = ego_embeddings
+            for i in range(self.n_layers):
+                ego_embeddings = self.norm_adj.mm(ego_embeddings)
+                sum_embeddings = sum_embeddings + ego_embeddings
+            all_embeddings = sum_embeddings / (self.n_layers + 1)
+            return torch.split(all_embeddings, [self.n_users, self.n_items], dim=0)
         all_embeddings = [ego_embeddings]
         for i in range(self.n_layers):
-            ego_embeddings = torch.sparse.mm(self.norm_adj, ego_embeddings)
+            ego_embeddings = self.norm_adj.mm(ego_embeddings)
             all_embeddings += [ego_embeddings]
         all_embeddings = torch.stack(all_embeddings, dim=1)
         all_embeddings = all_embeddings.mean(dim=1, keepdim=False)
-        u_g_embeddings, i_g_embeddings = torch.split(all_embeddings, [self.n_users, self.n_items], dim=0)
-        mm_item = None
+        return torch.split(all_embeddings, [self.n_users, self.n_items], dim=0)
+
+    def forward(self):
+        """
+        Returns:
+            BM3Output: graph user/item embeddings, with the text/image projections when the items used them
+        """
+        h = self.item_id_embedding.weight
+
+        u_g_embeddings, i_g_embeddings = self._propagate()
+        mm_item, t_proj, v_proj = None, None, None
         if self.mm_weight_learnable or (self.mm_weight is not None and self.mm_weight != 0):
-            mm_item = self._compute_mm_item()
+            t_proj, v_proj = self._project_modalities()
+            mm_item = self._compute_mm_item(t_proj, v_proj)
         if mm_item is not None:
             if self.mm_weight_learnable:
                 weight_input = torch.cat([i_g_embeddings + h, mm_item], dim=-1)
@@ -150,16 +345,23 @@ class BM3(GeneralRecommender):
                 i_out = i_g_embeddings + h + self.mm_weight * mm_item
         else:
             i_out = i_g_embeddings + h
-        return u_g_embeddings, i_out
+        return BM3Output(u_g_embeddings, i_out, t_proj, v_proj)
 
     def calculate_loss(self, interactions):
+        # the parameters are about to change: release the last evaluation snapshot
+        self._snapshot, self._snapshot_key = None, None
+        if self.sliced_loss:
+            return self._calculate_sliced_loss(interactions)
         # online network
-        u_online_ori, i_online_ori = self.forward()
-        t_feat_online, v_feat_online = None, None
-        if self.t_feat is not None:
-            t_feat_online = self.text_trs(self.text_embedding.weight)
-        if self.v_feat is not None:
-            v_feat_online = self.image_trs(self.image_embedding.weight)
+        out = self.forward()
+        u_online_ori, i_online_ori = out.user, out.item
+        t_feat_online, v_feat_online = out.text, out.image
+        if out.text is not None or out.image is not None:
+            self._count_shared_projection(self.n_items)
+        if self.t_feat is not None and t_feat_online is None:
+            t_feat_online = self.text_trs(self._raw_features('text'))
+        if self.v_feat is not None and v_feat_online is None:
+            v_feat_online = self.image_trs(self._raw_features('image'))
 
         with torch.no_grad():
             u_target, i_target = u_online_ori.clone(), i_online_ori.clone()
@@ -204,10 +406,82 @@ class BM3(GeneralRecommender):
         return (loss_ui + loss_iu).mean() + self.reg_weight * self.reg_loss(u_online_ori, i_online_ori) + \
                self.cl_weight * (loss_t + loss_v + loss_tv + loss_vt).mean()
 
+    def _calculate_sliced_loss(self, interactions):
+        r""":meth:`calculate_loss` with dropout, the predictor, the feature projections and the cosine terms applied
+        to the distinct users and items of the batch only.
+
+        Every distinct row draws one dropout mask, as a row of the full tables does, and rows are expanded back to
+        the batch afterwards, so the loss and its gradients follow the full-table computation. The regularization
+        stays on the full propagated tables: it is one norm per table and slicing it would change the objective,
+        which ``sliced_reg`` opts into by regularizing the batch's rows instead.
+        """
+        out = self.forward()
+        u_online_ori, i_online_ori = out.user, out.item
+        users, items = interactions[0], interactions[1]
+        u_rows, u_inv = torch.unique(users, return_inverse=True)
+        i_rows, i_inv = torch.unique(items, return_inverse=True)
+        u_batch, i_batch = u_online_ori[u_rows], i_online_ori[i_rows]
+        with torch.no_grad():
+            u_target = F.dropout(u_batch, self.dropout)[u_inv]
+            i_target = F.dropout(i_batch, self.dropout)[i_inv]
+        u_online, i_online = self.predictor(u_batch)[u_inv], self.predictor(i_batch)[i_inv]
+
+        shared = out.text is not None or out.image is not None
+        if shared:
+            self._count_shared_projection(len(i_rows))
+        loss_t, loss_v, loss_tv, loss_vt = 0.0, 0.0, 0.0, 0.0
+        if self.t_feat is not None:
+            t_feat_online = out.text[i_rows] if shared else self.text_trs(self._raw_features('text', i_rows))
+            with torch.no_grad():
+                t_feat_target = F.dropout(t_feat_online, self.dropout)[i_inv]
+            t_feat_online = self.predictor(t_feat_online)[i_inv]
+            loss_t = 1 - cosine_similarity(t_feat_online, i_target, dim=-1).mean()
+            loss_tv = 1 - cosine_similarity(t_feat_online, t_feat_target, dim=-1).mean()
+        if self.v_feat is not None:
+            v_feat_online = out.image[i_rows] if shared else self.image_trs(self._raw_features('image', i_rows))
+            with torch.no_grad():
+                v_feat_target = F.dropout(v_feat_online, self.dropout)[i_inv]
+            v_feat_online = self.predictor(v_feat_online)[i_inv]
+            loss_v = 1 - cosine_similarity(v_feat_online, i_target, dim=-1).mean()
+            loss_vt = 1 - cosine_similarity(v_feat_online, v_feat_target, dim=-1).mean()
+
+        loss_ui = 1 - cosine_similarity(u_online, i_target, dim=-1).mean()
+        loss_iu = 1 - cosine_similarity(i_online, u_target, dim=-1).mean()
+
+        if self.sliced_reg:
+            reg_loss = self.reg_loss(u_online_ori[users], i_online_ori[items])
+        else:
+            reg_loss = self.reg_loss(u_online_ori, i_online_ori)
+        return (loss_ui + loss_iu).mean() + self.reg_weight * reg_loss + \
+               self.cl_weight * (loss_t + loss_v + loss_tv + loss_vt).mean()
+
+    def _parameters_key(self):
+        # optimizer steps and load_state_dict update parameters in place, bumping their version counters
+        return tuple((p.data_ptr(), p._version) for p in self.parameters())
+
+    def inference_embeddings(self, pin=False):
+        r"""Projected user and item embeddings scored by :meth:`full_sort_predict`.
+
+        With ``eval_snapshot`` (or pinned), in eval mode without autograd the result is kept and reused until a
+        parameter changes, so one evaluation propagates the graph once instead of once per batch.
+        """
+        self._snapshot_pinned = self._snapshot_pinned or pin
+        if not (self.eval_snapshot or self._snapshot_pinned) or self.training or torch.is_grad_enabled():
+            out = self.forward()
+            return self.predictor(out.user), self.predictor(out.item)
+        key = self._parameters_key()
+        if self._snapshot is None or self._snapshot_key != key:
+            out = self.forward()
+            self._snapshot, self._snapshot_key = (self.predictor(out.user), self.predictor(out.item)), key
+        return self._snapshot
+
+    def release_inference_embeddings(self):
+        self._snapshot, self._snapshot_key = None, None
+        self._snapshot_pinned = False
+
     def full_sort_predict(self, interaction):
         user = interaction[0]
-        u_online, i_online = self.forward()
-        u_online, i_online = self.predictor(u_online), self.predictor(i_online)
+        u_online, i_online = self.inference_embeddings()
         score_mat_ui = torch.matmul(u_online[user], i_online.transpose(0, 1))
         return score_mat_ui
 
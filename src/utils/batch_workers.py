@@ -0,0 +1,151 @@
+# coding: utf-8
+"""
+Multi-process generation of training batches
+################################################
+"""
+from time import time
+from logging import getLogger
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from utils.history_index import CSRIndex
+from utils.sampler import NegativeSampler, NeighborhoodSampler
+
+
+def _build_batch(spec, cols, b, rng, samplers):
+    """Assemble batch ``b`` of the epoch, laid out like :class:`~utils.dataloader.TrainDataLoader` batches.
+    """
+    start, end = b * spec['step'], min((b + 1) * spec['step'], spec['n_rows'])
+    if spec['mode'] == 'full':
+        return cols[0, start: end].astype(np.int64)
+    users, items = cols[0, start: end].astype(np.int64), cols[1, start: end].astype(np.int64)
+    rows = [users, items]
+    if spec['mode'] == 'neg':
+        samplers['neg'].rng = rng
+        rows.extend(samplers['neg'].sample(users, spec['neg_num']))
+        if 'item_neighbor' in samplers:
+            samplers['item_neighbor'].rng = rng
+            rows.extend(samplers['item_neighbor'].sample(items))
+    return np.stack(rows)
+
+
+def _worker_loop(worker_id, n_workers, spec, shared, task_queue, out_queue):
+    """Produce the batches ``worker_id, worker_id + n_workers, ...`` of every epoch announced on ``task_queue``.
+
+    Every batch draws from its own stream seeded by ``(seed, epoch, batch index)``, so the output does not depend on
+    the number of workers.
+    """
+    torch.set_num_threads(1)
+    arrays = {k: v.numpy() for k, v in shared.items()}
+    samplers = {}
+    if spec['mode'] == 'neg':
+        user_items = CSRIndex.from_arrays(arrays['user_items_indptr'], arrays['user_items_indices'])
+        samplers['neg'] = NegativeSampler(user_items, arrays['item_candidates'])
+        if 'item_item_indptr' in arrays:
+            item_item = CSRIndex.from_arrays(arrays['item_item_indptr'], arrays['item_item_indices'])
+            samplers['item_neighbor'] = NeighborhoodSampler(item_item, arrays['item_candidates'])
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        seed, epoch, n_rows = task
+        epoch_spec = dict(spec, n_rows=n_rows)
+        n_batches = (n_rows + spec['step'] - 1) // spec['step']
+        busy, n_batch, n_sample = 0.0, 0, 0
+        for b in range(worker_id, n_batches, n_workers):
+            start = time()
+            rng = np.random.default_rng([seed, epoch, b])
+            batch = _build_batch(epoch_spec, arrays['epoch_cols'], b, rng, samplers)
+            busy += time() - start
+            n_batch += 1
+            n_sample += batch.shape[-1]
+            out_queue.put((b, batch))
+        out_queue.put(('stats', {'worker': worker_id, 'batches': n_batch, 'samples': n_sample, 'busy': busy}))
+
+
+class BatchWorkerPool(object):
+    r"""Worker processes producing disjoint shards of every epoch's training batches.
+
+    Static arrays (training history, candidates, neighbor graphs) and the epoch's shuffled columns are shared
+    with the workers through torch shared memory; batch ``b`` is produced by worker ``b % n_workers`` and handed
+    out in order.
+
+    Args:
+        n_workers (int): number of worker processes
+        spec (dict): ``mode`` ('neg', 'non_neg' or 'full'), ``step`` and ``neg_num``
+        arrays (dict): name -> np.ndarray shared read-only with the workers
+        max_rows (int): capacity of the per-epoch columns
+        prefetch (int): batches each worker may run ahead
+    """
+    def __init__(self, n_workers, spec, arrays, max_rows, prefetch=2):
+        self.logger = getLogger()
+        self.n_workers = n_workers
+        self.spec = spec
+        self.shared = {k: torch.from_numpy(np.ascontiguousarray(v)).share_memory_() for k, v in arrays.items()}
+        self.shared['epoch_cols'] = torch.zeros((2, max_rows), dtype=torch.int32).share_memory_()
+        # spawned, not forked: a fork of a parent whose OpenMP pool or queue feeder threads are running can deadlock
+        ctx = mp.get_context('spawn')
+        self.task_queues = [ctx.Queue() for _ in range(n_workers)]
+        self.out_queues = [ctx.Queue(maxsize=max(prefetch, 1)) for _ in range(n_workers)]
+        self.workers = []
+        for w in range(n_workers):
+            p = ctx.Process(target=_worker_loop, args=(w, n_workers, spec, self.shared, self.task_queues[w],
+                                                        self.out_queues[w]), daemon=True)
+            p.start()
+            self.workers.append(p)
+        self.n_batches = 0
+        self.next_b = 0
+
+    @property
+    def epoch_done(self):
+        return self.next_b >= self.n_batches
+
+    def start_epoch(self, seed, epoch, *cols):
+        """Publish the epoch's (shuffled) columns and let the workers start on their shards.
+        """
+        n_rows = len(cols[0])
+        for k, col in enumerate(cols):
+            self.shared['epoch_cols'][k, :n_rows] = torch.from_numpy(np.asarray(col, dtype=np.int32))
+        self.n_batches = (n_rows + self.spec['step'] - 1) // self.spec['step']
+        self.next_b = 0
+        self.epoch_start = time()
+        for q in self.task_queues:
+            q.put((seed, epoch, n_rows))
+        if self.n_batches == 0:
+            self._log_stats()
+
+    def next_batch(self):
+        """
+        Returns:
+            torch.Tensor: the next batch in order, or None when the epoch is over.
+        """
+        if self.epoch_done:
+            return None
+        b, batch = self.out_queues[self.next_b % self.n_workers].get()
+        assert b == self.next_b, 'batch {} received, {} expected'.format(b, self.next_b)
+        self.next_b += 1
+        if self.epoch_done:
+            self._log_stats()
+        return torch.from_numpy(batch)
+
+    def _log_stats(self):
+        wall = time() - self.epoch_start
+        for q in self.out_queues:
+            _, stats = q.get()
+            self.logger.info('train worker {} [batches: {}, busy: {:.2f}s, {:.0f} samples/s busy, '
+                             '{:.0f} samples/s wall]'.format(stats['worker'], stats['batches'], stats['busy'],
+                                                             stats['samples'] / max(stats['busy'], 1e-9),
+                                                             stats['samples'] / max(wall, 1e-9)))
+
+    def close(self):
+        for q in self.task_queues:
+            q.put(None)
+        for p in self.workers:
+            if self.epoch_done:
+                p.join(timeout=1)
+            if p.is_alive():
+                p.terminate()
+                p.join()
+        self.workers = []
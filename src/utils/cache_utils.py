@@ -0,0 +1,110 @@
+# coding: utf-8
+"""
+On-disk caches of numpy arrays keyed by content fingerprints
+################################################
+"""
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+
+def file_digest(file_path, chunk_size=1 << 22):
+    r"""sha1 of a file's content, read in chunks.
+
+    Args:
+        file_path (str): the file to hash
+        chunk_size (int): bytes read per chunk
+
+    Returns:
+        str: hex digest
+    """
+    h = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def config_digest(*parts):
+    r"""sha1 of the ``repr`` of the given parts, e.g. config fields or other digests.
+    """
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def array_digest(*arrays):
+    r"""sha1 over the raw bytes, dtype and shape of the given arrays.
+    """
+    h = hashlib.sha1()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        h.update(str((arr.dtype.str, arr.shape)).encode('utf-8'))
+        h.update(arr.data)
+    return h.hexdigest()
+
+
+def _tmp_dir(cache_dir):
+    parent = os.path.dirname(os.path.abspath(cache_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = '{}.tmp-{}'.format(cache_dir, os.getpid())
+    os.makedirs(tmp_dir, exist_ok=True)
+    return tmp_dir
+
+
+def _publish(tmp_dir, cache_dir, meta):
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta or {}, f)
+    try:
+        os.rename(tmp_dir, cache_dir)
+    except OSError:
+        # another job finished the same cache first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def save_arrays(cache_dir, arrays, meta=None):
+    r"""Write ``arrays`` (name -> np.ndarray) as ``.npy`` files under ``cache_dir``.
+
+    Files are written to a temporary sibling directory which is renamed into place at the end,
+    so concurrent jobs never read a half-written cache.
+    """
+    tmp_dir = _tmp_dir(cache_dir)
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp_dir, name + '.npy'), np.ascontiguousarray(arr))
+    _publish(tmp_dir, cache_dir, meta)
+
+
+def save_permuted_rows(cache_dir, name, src, perm, chunk_rows=65536, meta=None):
+    r"""Write ``src[perm]`` as ``name.npy`` under ``cache_dir``, like :func:`save_arrays`.
+
+    Rows are gathered ``chunk_rows`` at a time into a memory-mapped output, so a memory-mapped ``src``
+    is never read into memory as a whole.
+    """
+    tmp_dir = _tmp_dir(cache_dir)
+    out = np.lib.format.open_memmap(os.path.join(tmp_dir, name + '.npy'), mode='w+', dtype=src.dtype,
+                                    shape=(len(perm),) + src.shape[1:])
+    for s in range(0, len(perm), chunk_rows):
+        out[s: s + chunk_rows] = src[perm[s: s + chunk_rows]]
+    out.flush()
+    del out
+    _publish(tmp_dir, cache_dir, meta)
+
+
+def load_arrays(cache_dir, names, mmap_mode='r'):
+    r"""Load the arrays written by :func:`save_arrays`, memory-mapped by default.
+
+    Returns:
+        (dict, dict): arrays by name and the meta dict, or ``(None, None)`` if the cache is absent.
+    """
+    meta_file = os.path.join(cache_dir, 'meta.json')
+    if not os.path.isfile(meta_file):
+        return None, None
+    with open(meta_file, 'r') as f:
+        meta = json.load(f)
+    arrays = {}
+    for name in names:
+        arr_file = os.path.join(cache_dir, name + '.npy')
+        if not os.path.isfile(arr_file):
+            return None, None
+        arrays[name] = np.load(arr_file, mmap_mode=mmap_mode)
+    return arrays, meta
@@ -5,11 +5,17 @@ Wrap dataset into dataloader
 ################################################
 """
 import math
+import queue
+import threading
 import torch
 import random
 import numpy as np
+from time import time
 from logging import getLogger
 from scipy.sparse import coo_matrix
+from utils.sampler import NegativeSampler, NeighborhoodSampler
+from utils.history_index import co_occurrence_index
+from utils.batch_workers import BatchWorkerPool
 
 
 class AbstractDataLoader(object):
@@ -110,16 +116,21 @@ class TrainDataLoader(AbstractDataLoader):
         super().__init__(config, dataset, additional_dataset=None,
                          batch_size=batch_size, neg_sampling=True, shuffle=shuffle)
 
-        # special for training dataloader
-        self.history_items_per_u = dict()
+        # special for training dataloader, CSR user->items / item->users history shared with eval dataloaders
+        self.history_index = self.dataset.get_history_index()
         # full items in training.
         self.all_items = self.dataset.df[self.dataset.iid_field].unique().tolist()
         self.all_uids = self.dataset.df[self.dataset.uid_field].unique()
-        self.all_items_set = set(self.all_items)
-        self.all_users_set = set(self.all_uids)
         self.all_item_len = len(self.all_items)
         # if full sampling
         self.use_full_sampling = config['use_full_sampling']
+        # batched negative sampling against the sorted training history, honours training_neg_sample_num
+        self.neg_sampler = None
+        self.neg_sample_num = 1
+        if config['vectorized_neg_sampling']:
+            self.neg_sampler = NegativeSampler(self.history_index.user_items, np.asarray(self.all_items),
+                                               seed=config['seed'])
+            self.neg_sample_num = config['training_neg_sample_num'] or 1
 
         if config['use_neg_sampling']:
             if self.use_full_sampling:
@@ -129,19 +140,33 @@ class TrainDataLoader(AbstractDataLoader):
         else:
             self.sample_func = self._get_non_neg_sample
 
-        self._get_history_items_u()
         self.neighborhood_loss_required = config['use_neighborhood_loss']
         if self.neighborhood_loss_required:
-            self.history_users_per_i = {}
-            self._get_history_users_i()
-            self.user_user_dict = self._get_my_neighbors(self.config['USER_ID_FIELD'])
-            self.item_item_dict = self._get_my_neighbors(self.config['ITEM_ID_FIELD'])
+            # co-occurrence graphs as CSR indexes, optionally capped to the top-k neighbors per node
+            topk = config['neighborhood_topk'] or 0
+            self.user_user_index = co_occurrence_index(self.history_index.user_items, self.dataset.item_num, topk)
+            self.item_item_index = co_occurrence_index(self.history_index.item_users, self.dataset.user_num, topk)
+            self.user_neighbor_sampler = NeighborhoodSampler(self.user_user_index, self.all_uids)
+            self.item_neighbor_sampler = NeighborhoodSampler(self.item_item_index, np.asarray(self.all_items))
+
+        # background producer preparing the next `train_prefetch` batches while the model step runs
+        self.prefetch = config['train_prefetch'] or 0
+        self._producer = None
+        self._batch_queue = None
+        self._stop_event = None
+        self.epoch_stats = None
+        # worker processes producing disjoint shards of every epoch's batches
+        self.num_workers = config['train_workers'] or 0
+        self._pool = None
+        self._epoch = 0
 
     def pretrain_setup(self):
         """
         Reset dataloader. Outputing the same positive & negative samples with each training.
         :return:
         """
+        self._stop_prefetch()
+        self._epoch = 0
         # sort & random
         if self.shuffle:
             self.dataset = self.dataset_bk.copy(self.dataset_bk.df)
@@ -149,6 +174,11 @@ class TrainDataLoader(AbstractDataLoader):
         if self.use_full_sampling:
             self.all_uids.sort()
         random.shuffle(self.all_items)
+        if self.neg_sampler is not None:
+            self.neg_sampler.seed(self.config['seed'])
+        if self.neighborhood_loss_required:
+            self.user_neighbor_sampler.seed([self.config['seed'], 1])
+            self.item_neighbor_sampler.seed([self.config['seed'], 2])
         # reorder dataset as default (chronological order)
         #self.dataset.sort_by_chronological()
 
@@ -209,6 +239,125 @@ class TrainDataLoader(AbstractDataLoader):
         else:
             raise NotImplementedError('sparse matrix format [{}] has not been implemented.'.format(form))
 
+    def __iter__(self):
+        self._stop_prefetch()
+        super().__iter__()
+        if self.num_workers > 0:
+            self._start_workers()
+        elif self.prefetch > 0:
+            self._start_prefetch()
+        return self
+
+    def __next__(self):
+        if self._pool is not None:
+            batch = self._pool.next_batch()
+            if batch is None:
+                raise StopIteration()
+            return batch.to(self.device)
+        if self._producer is None:
+            return super().__next__()
+        start = time()
+        batch = self._batch_queue.get()
+        self.epoch_stats['wait_time'] += time() - start
+        if isinstance(batch, Exception):
+            self._stop_prefetch()
+            raise batch
+        if batch is None:
+            self._stop_prefetch()
+            stats = self.epoch_stats
+            self.logger.info('train loader prefetch [batches: {}, produce: {:.2f}s, wait: {:.2f}s, '
+                             'hidden: {:.2f}s]'.format(stats['batches'], stats['produce_time'], stats['wait_time'],
+                                                       max(stats['produce_time'] - stats['wait_time'], 0.0)))
+            raise StopIteration()
+        return batch
+
+    def _start_prefetch(self):
+        """Start a producer thread filling a queue of at most ``self.prefetch`` batches.
+
+        It calls :meth:`_next_batch_data` in the same order as the synchronous path, and the training step draws
+        nothing from the loader's random streams, so batches are identical for the same seed.
+        """
+        self.epoch_stats = {'batches': 0, 'produce_time': 0.0, 'wait_time': 0.0}
+        self._batch_queue = queue.Queue(maxsize=self.prefetch)
+        self._stop_event = threading.Event()
+        self._producer = threading.Thread(target=self._produce, args=(self._batch_queue, self._stop_event),
+                                          daemon=True)
+        self._producer.start()
+
+    def _produce(self, batch_queue, stop_event):
+        item = None
+        try:
+            while self.pr < self.pr_end and not stop_event.is_set():
+                start = time()
+                batch = self._next_batch_data()
+                self.epoch_stats['produce_time'] += time() - start
+                self.epoch_stats['batches'] += 1
+                self._put(batch_queue, stop_event, batch)
+        except Exception as e:
+            item = e
+        self._put(batch_queue, stop_event, item)
+
+    @staticmethod
+    def _put(batch_queue, stop_event, item):
+        while not stop_event.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _start_workers(self):
+        """Hand the epoch's shuffled columns to the worker pool, creating it on first use.
+
+        Workers sample with the vectorized samplers; each batch draws from a stream seeded by
+        ``(seed, epoch, batch index)``, so batches do not depend on ``train_workers``.
+        """
+        if self._pool is not None and not self._pool.epoch_done:
+            # an epoch was left early, its workers may still be blocked on it
+            self._pool.close()
+            self._pool = None
+        if self._pool is None:
+            self._pool = self._build_worker_pool()
+        self._epoch += 1
+        if self.use_full_sampling:
+            cols = (self.all_uids,)
+        else:
+            cur_data = self.dataset[0: len(self.dataset)]
+            cols = (np.asarray(cur_data[self.config['USER_ID_FIELD']]),
+                    np.asarray(cur_data[self.config['ITEM_ID_FIELD']]))
+        self._pool.start_epoch(self.config['seed'], self._epoch, *cols)
+
+    def _build_worker_pool(self):
+        if self.sample_func == self._get_full_uids_sample:
+            mode = 'full'
+        elif self.sample_func == self._get_neg_sample:
+            mode = 'neg'
+        else:
+            mode = 'non_neg'
+        arrays = {}
+        if mode == 'neg':
+            arrays['user_items_indptr'] = self.history_index.user_items.indptr
+            arrays['user_items_indices'] = self.history_index.user_items.indices
+            arrays['item_candidates'] = np.sort(np.asarray(self.all_items))
+            if self.neighborhood_loss_required:
+                arrays['item_item_indptr'] = self.item_item_index.indptr
+                arrays['item_item_indices'] = self.item_item_index.indices
+        # the same negatives per row as the in-process sampler
+        spec = {'mode': mode, 'step': self.step, 'neg_num': self.neg_sample_num}
+        max_rows = len(self.all_uids) if mode == 'full' else len(self.dataset)
+        return BatchWorkerPool(self.num_workers, spec, arrays, max_rows, prefetch=max(self.prefetch, 2))
+
+    def _stop_prefetch(self):
+        """Stop the producer, e.g. when an epoch is left early, and rewind the pointers.
+        """
+        if self._producer is None:
+            return
+        self._stop_event.set()
+        self._producer.join()
+        self._producer = None
+        self.pr = 0
+        self.inter_pr = 0
+
     @property
     def pr_end(self):
         if self.use_full_sampling:
@@ -227,25 +376,25 @@ class TrainDataLoader(AbstractDataLoader):
         cur_data = self.dataset[self.pr: self.pr + self.step]
         self.pr += self.step
         # to tensor
-        user_tensor = torch.tensor(cur_data[self.config['USER_ID_FIELD']].values).type(torch.LongTensor).to(self.device)
-        item_tensor = torch.tensor(cur_data[self.config['ITEM_ID_FIELD']].values).type(torch.LongTensor).to(self.device)
+        user_tensor = self._column_to_tensor(cur_data[self.config['USER_ID_FIELD']])
+        item_tensor = self._column_to_tensor(cur_data[self.config['ITEM_ID_FIELD']])
         batch_tensor = torch.cat((torch.unsqueeze(user_tensor, 0),
                                   torch.unsqueeze(item_tensor, 0)))
         u_ids = cur_data[self.config['USER_ID_FIELD']]
-        # sampling negative items only in the dataset (train)
-        neg_ids = self._sample_neg_ids(u_ids).to(self.device)
+        # sampling negative items only in the dataset (train), one row per negative
+        neg_ids = self._sample_neg_ids(u_ids).to(self.device).view(-1, user_tensor.shape[0])
         # for neighborhood loss
         if self.neighborhood_loss_required:
             i_ids = cur_data[self.config['ITEM_ID_FIELD']]
             pos_neighbors, neg_neighbors = self._get_neighborhood_samples(i_ids, self.config['ITEM_ID_FIELD'])
             pos_neighbors, neg_neighbors = pos_neighbors.to(self.device), neg_neighbors.to(self.device)
 
-            batch_tensor = torch.cat((batch_tensor, neg_ids.unsqueeze(0),
+            batch_tensor = torch.cat((batch_tensor, neg_ids,
                                       pos_neighbors.unsqueeze(0), neg_neighbors.unsqueeze(0)))
 
         # merge negative samples
         else:
-            batch_tensor = torch.cat((batch_tensor, neg_ids.unsqueeze(0)))
+            batch_tensor = torch.cat((batch_tensor, neg_ids))
 
         return batch_tensor
 
@@ -253,79 +402,50 @@ class TrainDataLoader(AbstractDataLoader):
         cur_data = self.dataset[self.pr: self.pr + self.step]
         self.pr += self.step
         # to tensor
-        user_tensor = torch.tensor(cur_data[self.config['USER_ID_FIELD']].values).type(torch.LongTensor).to(self.device)
-        item_tensor = torch.tensor(cur_data[self.config['ITEM_ID_FIELD']].values).type(torch.LongTensor).to(self.device)
+        user_tensor = self._column_to_tensor(cur_data[self.config['USER_ID_FIELD']])
+        item_tensor = self._column_to_tensor(cur_data[self.config['ITEM_ID_FIELD']])
         batch_tensor = torch.cat((torch.unsqueeze(user_tensor, 0),
                                   torch.unsqueeze(item_tensor, 0)))
         return batch_tensor
 
+    def _column_to_tensor(self, col):
+        """Wrap a batch column (pandas Series or numpy slice of an array-backed dataset) into a LongTensor.
+        """
+        return torch.from_numpy(np.asarray(col)).type(torch.LongTensor).to(self.device)
+
     def _get_full_uids_sample(self):
         user_tensor = torch.tensor(self.all_uids[self.pr: self.pr + self.step]).type(torch.LongTensor).to(self.device)
         self.pr += self.step
         return user_tensor
 
     def _sample_neg_ids(self, u_ids):
-        neg_ids = []
-        for u in u_ids:
-            # random 1 item
-            iid = self._random()
-            while iid in self.history_items_per_u[u]:
-                iid = self._random()
-            neg_ids.append(iid)
-        return torch.tensor(neg_ids).type(torch.LongTensor)
-
-    def _get_my_neighbors(self, id_str):
-        ret_dict = {}
-        a2b_dict = self.history_items_per_u if id_str == self.config['USER_ID_FIELD'] else self.history_users_per_i
-        b2a_dict = self.history_users_per_i if id_str == self.config['USER_ID_FIELD'] else self.history_items_per_u
-        for i, j in a2b_dict.items():
-            k = set()
-            for m in j:
-                k |= b2a_dict.get(m, set()).copy()
-            k.discard(i)                        # remove myself
-            ret_dict[i] = k
-        return ret_dict
+        if self.neg_sampler is not None:
+            return torch.from_numpy(self.neg_sampler.sample(np.asarray(u_ids), self.neg_sample_num))
+        # users take the random draws in turn, a user retrying on an item it has seen: draw one item per user
+        # still waiting, accept the run up to the first seen one with a single vectorized contains(), repeat
+        users = np.asarray(u_ids, dtype=np.int64)
+        neg_ids = np.empty(len(users), dtype=np.int64)
+        draws, k, j = [], 0, 0
+        while k < len(users):
+            waiting = len(users) - k
+            draws.extend(self._random() for _ in range(waiting - (len(draws) - j)))
+            cand = np.asarray(draws[j: j + waiting], dtype=np.int64)
+            seen = self.history_index.user_items.contains(users[k:], cand)
+            run = int(np.argmax(seen)) if seen.any() else waiting
+            neg_ids[k: k + run] = cand[:run]
+            # the rejected draw is consumed, the user retries with the next one
+            k, j = k + run, j + run + 1
+        return torch.from_numpy(neg_ids)
 
     def _get_neighborhood_samples(self, ids, id_str):
-        a2a_dict = self.user_user_dict if id_str == self.config['USER_ID_FIELD'] else self.item_item_dict
-        all_set = self.all_users_set if id_str == self.config['USER_ID_FIELD'] else self.all_items_set
-        pos_ids, neg_ids = [], []
-        for i in ids:
-            pos_ids_my = a2a_dict[i]
-            if len(pos_ids_my) <= 0 or len(pos_ids_my)/len(all_set) > 0.8:
-                pos_ids.append(0)
-                neg_ids.append(0)
-                continue
-            pos_id = random.sample(pos_ids_my, 1)[0]
-            pos_ids.append(pos_id)
-            neg_id = random.sample(all_set, 1)[0]
-            while neg_id in pos_ids_my:
-                neg_id = random.sample(all_set, 1)[0]
-            neg_ids.append(neg_id)
-        return torch.tensor(pos_ids).type(torch.LongTensor), torch.tensor(neg_ids).type(torch.LongTensor)
+        sampler = self.user_neighbor_sampler if id_str == self.config['USER_ID_FIELD'] else self.item_neighbor_sampler
+        pos_ids, neg_ids = sampler.sample(np.asarray(ids))
+        return torch.from_numpy(pos_ids), torch.from_numpy(neg_ids)
 
     def _random(self):
         rd_id = random.sample(self.all_items, 1)[0]
         return rd_id
 
-    def _get_history_items_u(self):
-        uid_field = self.dataset.uid_field
-        iid_field = self.dataset.iid_field
-        # load avail items for all uid
-        uid_freq = self.dataset.df.groupby(uid_field)[iid_field]
-        for u, u_ls in uid_freq:
-            self.history_items_per_u[u] = set(u_ls.values)
-        return self.history_items_per_u
-
-    def _get_history_users_i(self):
-        uid_field = self.dataset.uid_field
-        iid_field = self.dataset.iid_field
-        # load avail items for all uid
-        iid_freq = self.dataset.df.groupby(iid_field)[uid_field]
-        for i, u_ls in iid_freq:
-            self.history_users_per_i[i] = set(u_ls.values)
-        return self.history_users_per_i
-
 
 class EvalDataLoader(AbstractDataLoader):
     """
@@ -340,11 +460,10 @@ class EvalDataLoader(AbstractDataLoader):
             raise ValueError('Training datasets is nan')
         self.eval_items_per_u = []
         self.eval_len_list = []
-        self.train_pos_len_list = []
 
         self.eval_u = self.dataset.df[self.dataset.uid_field].unique()
         # special for eval dataloader
-        self.pos_items_per_u = self._get_pos_items_per_u(self.eval_u).to(self.device)
+        self._get_pos_items_per_u(self.eval_u)
         self._get_eval_items_per_u(self.eval_u)
         # to device
         self.eval_u = torch.tensor(self.eval_u).type(torch.LongTensor).to(self.device)
@@ -357,38 +476,33 @@ class EvalDataLoader(AbstractDataLoader):
         self.dataset.shuffle()
 
     def _next_batch_data(self):
-        inter_cnt = sum(self.train_pos_len_list[self.pr: self.pr+self.step])
         batch_users = self.eval_u[self.pr: self.pr + self.step]
-        batch_mask_matrix = self.pos_items_per_u[:, self.inter_pr: self.inter_pr+inter_cnt].clone()
-        # user_ids to index
-        batch_mask_matrix[0] -= self.pr
-        self.inter_pr += inter_cnt
+        # mask of training positives: views of the CSR rows of this batch
+        start = self.pos_indptr[self.pr]
+        end = self.pos_indptr[min(self.pr + self.step, self.pr_end)]
+        batch_mask_matrix = (self.pos_rows[start: end], self.pos_items[start: end])
         self.pr += self.step
 
         return [batch_users, batch_mask_matrix]
 
     def _get_pos_items_per_u(self, eval_users):
         """
-        history items in training dataset.
-        masking out positive items in evaluation
-        :return:
-        user_id - item_ids matrix
-        [[0, 0, ... , 1, ...],
-         [0, 1, ... , 0, ...]]
+        history items in training dataset, masked out in evaluation, as CSR over the eval users:
+        ``pos_items[pos_indptr[k]: pos_indptr[k + 1]]`` are the (int32) training items of ``eval_users[k]``.
+        ``pos_rows`` holds each entry's row within its eval batch, which starts at a multiple of the batch size.
+        The history is de-duplicated, so a (user, item) pair repeated in the training file is masked once.
         """
-        uid_field = self.additional_dataset.uid_field
-        iid_field = self.additional_dataset.iid_field
-        # load avail items for all uid
-        uid_freq = self.additional_dataset.df.groupby(uid_field)[iid_field]
-        u_ids = []
-        i_ids = []
-        for i, u in enumerate(eval_users):
-            u_ls = uid_freq.get_group(u).values
-            i_len = len(u_ls)
-            self.train_pos_len_list.append(i_len)
-            u_ids.extend([i]*i_len)
-            i_ids.extend(u_ls)
-        return torch.tensor([u_ids, i_ids]).type(torch.LongTensor)
+        # training history, shared with the training dataloader
+        user_items = self.additional_dataset.get_history_index().user_items
+        pos_len, pos_items = user_items.gather(eval_users)
+        self.pos_indptr = np.concatenate([[0], np.cumsum(pos_len)])
+        rows = np.repeat(np.arange(len(eval_users)), pos_len) % self.step
+        row_dtype = np.int16 if self.step <= np.iinfo(np.int16).max + 1 else np.int32
+        self.pos_rows = torch.from_numpy(rows.astype(row_dtype)).to(self.device)
+        self.pos_items = torch.from_numpy(pos_items).to(self.device)
+        self.logger.info('eval mask [users: {}, entries: {}, size: {:.2f}MB]'.format(
+            len(eval_users), len(pos_items),
+            (self.pos_rows.element_size() + self.pos_items.element_size()) * len(pos_items) / 1024.0 ** 2))
 
     def _get_eval_items_per_u(self, eval_users):
         """
@@ -397,13 +511,14 @@ class EvalDataLoader(AbstractDataLoader):
         """
         uid_field = self.dataset.uid_field
         iid_field = self.dataset.iid_field
-        # load avail items for all uid
-        uid_freq = self.dataset.df.groupby(uid_field)[iid_field]
-        for u in eval_users:
-            u_ls = uid_freq.get_group(u).values
-            self.eval_len_list.append(len(u_ls))
-            self.eval_items_per_u.append(u_ls)
-        self.eval_len_list = np.asarray(self.eval_len_list)
+        # one stable sort by user keeps every user's items in file order, as groupby does
+        uids = self.dataset.df[uid_field].values
+        order = np.argsort(uids, kind='stable')
+        sorted_uids, sorted_items = uids[order], self.dataset.df[iid_field].values[order]
+        starts = np.searchsorted(sorted_uids, eval_users, side='left')
+        ends = np.searchsorted(sorted_uids, eval_users, side='right')
+        self.eval_len_list = ends - starts
+        self.eval_items_per_u = [sorted_items[s: e] for s, e in zip(starts, ends)]
 
     # return pos_items for each u
     def get_eval_items(self):
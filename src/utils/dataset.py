@@ -10,16 +10,20 @@ Data pre-processing
 """
 from logging import getLogger
 from collections import Counter
+from time import time
 import os
 import pandas as pd
 import numpy as np
 import torch
 from utils.data_utils import (ImageResize, ImagePad, image_to_tensor, load_decompress_img_from_lmdb_value)
+from utils.cache_utils import file_digest, config_digest, save_arrays, load_arrays
+from utils.history_index import HistoryIndex
+from utils.reorder import node_order, inverse_permutation
 import lmdb
 
 
 class RecDataset(object):
-    def __init__(self, config, df=None):
+    def __init__(self, config, df=None, inter_arrays=None):
         self.config = config
         self.logger = getLogger()
 
@@ -31,9 +35,15 @@ class RecDataset(object):
         self.uid_field = self.config['USER_ID_FIELD']
         self.iid_field = self.config['ITEM_ID_FIELD']
         self.splitting_label = self.config['inter_splitting_label']
+        # array-backed mode: uid/iid columns as contiguous int32 arrays
+        self.array_backed = bool(self.config['array_backed_dataset'])
+        self.history_index = None
+        # new id -> original id, when nodes are relabeled for locality
+        self.user_perm, self.item_perm = None, None
 
         if df is not None:
             self.df = df
+            self.inter_arrays = inter_arrays if inter_arrays is not None else self._build_inter_arrays()
             return
         # if all files exists
         check_file_list = [self.config['inter_file_name']]
@@ -46,14 +56,81 @@ class RecDataset(object):
         self.load_inter_graph(config['inter_file_name'])
         self.item_num = int(max(self.df[self.iid_field].values)) + 1
         self.user_num = int(max(self.df[self.uid_field].values)) + 1
+        if self.config['node_reorder'] not in (None, False, 'none'):
+            self._reorder_nodes(self.config['node_reorder'])
+        self.inter_arrays = self._build_inter_arrays()
+
+    def _reorder_nodes(self, method):
+        """Relabel users and items in the order :func:`~utils.reorder.node_order` computes on the training
+        interactions. The original ids stay available as ``user_perm[new_id]`` / ``item_perm[new_id]``.
+        """
+        start = time()
+        train = self.df[self.splitting_label].values == 0
+        self.user_perm, self.item_perm = node_order(self.df[self.uid_field].values[train],
+                                                    self.df[self.iid_field].values[train],
+                                                    self.user_num, self.item_num, method)
+        for field, perm in [(self.uid_field, self.user_perm), (self.iid_field, self.item_perm)]:
+            col = self.df[field].values
+            self.df[field] = inverse_permutation(perm)[col].astype(col.dtype)
+        self.logger.info('nodes reordered [method: {}, time: {:.2f}s]'.format(method, time() - start))
+
+    def original_user_ids(self, uids):
+        return uids if self.user_perm is None else self.user_perm[np.asarray(uids)]
+
+    def original_item_ids(self, iids):
+        return iids if self.item_perm is None else self.item_perm[np.asarray(iids)]
+
+    def _build_inter_arrays(self):
+        """uid/iid columns of ``self.df`` as contiguous int32 arrays, or None if not array-backed.
+        """
+        if not self.array_backed:
+            return None
+        return {field: np.array(self.df[field].values, dtype=np.int32)
+                for field in [self.uid_field, self.iid_field]}
 
     def load_inter_graph(self, file_name):
         inter_file = os.path.join(self.dataset_path, file_name)
         cols = [self.uid_field, self.iid_field, self.splitting_label]
+        if self.config['inter_cache']:
+            self.df = self._load_inter_cache(inter_file, cols)
+            return
         self.df = pd.read_csv(inter_file, usecols=cols, sep=self.config['field_separator'])
         if not self.df.columns.isin(cols).all():
             raise ValueError('File {} lost some required columns.'.format(inter_file))
 
+    def _inter_cache_dir(self, inter_file, cols):
+        """Cache location, keyed by the content of ``inter_file`` and the fields used to parse it.
+        """
+        key = config_digest(file_digest(inter_file), cols, self.config['field_separator'])
+        cache_root = os.path.join(self.dataset_path, self.config['cache_dir'] or 'cache')
+        return os.path.join(cache_root, '{}-{}'.format(os.path.basename(inter_file), key[:16]))
+
+    def _load_inter_cache(self, inter_file, cols):
+        """Load interactions from the binary columnar cache, building it from ``inter_file`` on a miss.
+
+        Ids are stored as int32 and the splitting label as int8; the cached columns are memory-mapped.
+        """
+        start = time()
+        cache_dir = self._inter_cache_dir(inter_file, cols)
+        names = ['uid', 'iid', 'label']
+        arrays, _ = load_arrays(cache_dir, names)
+        if arrays is None:
+            df = pd.read_csv(inter_file, usecols=cols, sep=self.config['field_separator'])
+            if not df.columns.isin(cols).all():
+                raise ValueError('File {} lost some required columns.'.format(inter_file))
+            for col in cols[:2]:
+                if len(df) and (df[col].min() < 0 or df[col].max() > np.iinfo(np.int32).max):
+                    raise ValueError('Column {} of {} does not fit into int32.'.format(col, inter_file))
+            save_arrays(cache_dir, {'uid': df[cols[0]].values.astype(np.int32),
+                                    'iid': df[cols[1]].values.astype(np.int32),
+                                    'label': df[cols[2]].values.astype(np.int8)},
+                        meta={'source': inter_file, 'columns': cols, 'rows': len(df)})
+            arrays, _ = load_arrays(cache_dir, names)
+            self.logger.info('inter cache built at {} [time: {:.2f}s]'.format(cache_dir, time() - start))
+        else:
+            self.logger.info('inter cache hit at {} [time: {:.2f}s]'.format(cache_dir, time() - start))
+        return pd.DataFrame({cols[0]: arrays['uid'], cols[1]: arrays['iid'], cols[2]: arrays['label']})
+
     def split(self):
         dfs = []
         # splitting into training/validation/test
@@ -83,12 +160,29 @@ class RecDataset(object):
                 Returns:
                     :class:`~Dataset`: the new :class:`~Dataset` object, whose interaction feature has been updated.
                 """
-        nxt = RecDataset(self.config, new_df)
+        # arrays are never modified inplace, so a copy of the same frame can share them
+        inter_arrays = self.inter_arrays if new_df is self.df else None
+        nxt = RecDataset(self.config, new_df, inter_arrays=inter_arrays)
+        if new_df is self.df:
+            nxt.history_index = self.history_index
 
         nxt.item_num = self.item_num
         nxt.user_num = self.user_num
+        nxt.user_perm, nxt.item_perm = self.user_perm, self.item_perm
         return nxt
 
+    def get_history_index(self):
+        """CSR user->items and item->users index of the interactions, built on first use and then shared
+        by every dataloader holding this dataset.
+
+        Returns:
+            :class:`~utils.history_index.HistoryIndex`
+        """
+        if self.history_index is None:
+            self.history_index = HistoryIndex(self.df[self.uid_field].values, self.df[self.iid_field].values,
+                                              self.user_num, self.item_num)
+        return self.history_index
+
     def get_user_num(self):
         return self.user_num
 
@@ -97,13 +191,23 @@ class RecDataset(object):
 
     def shuffle(self):
         """Shuffle the interaction records inplace.
+
+        Array-backed datasets gather their columns with a permutation index instead of rebuilding the frame.
+        ``np.random.permutation`` draws the same order as ``df.sample(frac=1)``, so both modes yield the same batches.
         """
+        if self.array_backed:
+            order = np.random.permutation(len(self))
+            self.inter_arrays = {field: arr[order] for field, arr in self.inter_arrays.items()}
+            return
         self.df = self.df.sample(frac=1, replace=False).reset_index(drop=True)
 
     def __len__(self):
         return len(self.df)
 
     def __getitem__(self, idx):
+        if self.array_backed:
+            # dict of zero-copy array views
+            return {field: arr[idx] for field, arr in self.inter_arrays.items()}
         # Series result
         return self.df.iloc[idx]
 
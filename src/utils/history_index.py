@@ -0,0 +1,147 @@
+# coding: utf-8
+"""
+Compact CSR index of interaction histories
+################################################
+"""
+import numpy as np
+import scipy.sparse as sp
+
+
+class CSRIndex(object):
+    r"""Row-compressed adjacency between two id spaces.
+
+    The neighbors of row ``r`` are ``indices[indptr[r]: indptr[r + 1]]``, sorted ascending and de-duplicated.
+    ``indptr`` is int64 and ``indices`` int32, about 4 bytes per edge plus 8 per row.
+
+    Args:
+        rows (np.ndarray): source ids of the edges
+        cols (np.ndarray): target ids of the edges
+        n_rows (int): number of source ids
+    """
+    def __init__(self, rows, cols, n_rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        order = np.lexsort((cols, rows))
+        rows, cols = rows[order], cols[order]
+        if len(rows):
+            keep = np.ones(len(rows), dtype=bool)
+            keep[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+            rows, cols = rows[keep], cols[keep]
+        self.n_rows = int(n_rows)
+        self.indptr = np.zeros(self.n_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=self.n_rows), out=self.indptr[1:])
+        self.indices = cols.astype(np.int32)
+        self.max_degree = int(self.degree().max()) if self.n_rows else 0
+
+    @classmethod
+    def from_arrays(cls, indptr, indices):
+        """Wrap existing ``indptr``/``indices`` arrays (e.g. views of shared memory) without copying them.
+        """
+        index = cls.__new__(cls)
+        index.n_rows = len(indptr) - 1
+        index.indptr = indptr
+        index.indices = indices
+        index.max_degree = int(index.degree().max()) if index.n_rows else 0
+        return index
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+    def degree(self, rows=None):
+        """Number of neighbors of ``rows`` (all rows if None).
+        """
+        deg = np.diff(self.indptr)
+        return deg if rows is None else deg[rows]
+
+    def neighbors(self, row):
+        """Sorted neighbors of a single row, a view into :attr:`indices`.
+        """
+        return self.indices[self.indptr[row]: self.indptr[row + 1]]
+
+    def gather(self, rows):
+        """Neighbors of several rows, concatenated in the order of ``rows``, in one vectorized gather.
+
+        Returns:
+            (np.ndarray, np.ndarray): int64 neighbor count of every row and the int32 concatenated neighbors.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.indptr[rows]
+        lens = self.indptr[rows + 1] - starts
+        offsets = np.cumsum(lens) - lens
+        idx = np.arange(int(lens.sum()), dtype=np.int64) + np.repeat(starts - offsets, lens)
+        return lens, self.indices[idx]
+
+    def has(self, row, col):
+        """Whether ``col`` is a neighbor of ``row``, for scalar queries.
+        """
+        seg = self.neighbors(row)
+        k = np.searchsorted(seg, col)
+        return k < len(seg) and seg[k] == col
+
+    def contains(self, rows, cols):
+        """Vectorized :meth:`has`: a bisection within each query's row segment, run for all queries at once.
+
+        Returns:
+            np.ndarray: boolean mask, one entry per (rows[k], cols[k]).
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        if self.nnz == 0:
+            return np.zeros(len(rows), dtype=bool)
+        lo, hi = self.indptr[rows], self.indptr[rows + 1]
+        for _ in range(int(self.max_degree).bit_length()):
+            mid = (lo + hi) >> 1
+            go_right = (mid < hi) & (self.indices[np.minimum(mid, self.nnz - 1)] < cols)
+            lo = np.where(go_right, mid + 1, lo)
+            hi = np.where(go_right, hi, mid)
+        return (lo < self.indptr[rows + 1]) & (self.indices[np.minimum(lo, self.nnz - 1)] == cols)
+
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes
+
+
+class HistoryIndex(object):
+    r"""User->items and item->users CSR indexes of a set of interactions, built with vectorized sorting.
+    """
+    def __init__(self, uids, iids, n_users, n_items):
+        self.user_items = CSRIndex(uids, iids, n_users)
+        self.item_users = CSRIndex(iids, uids, n_items)
+
+    def nbytes(self):
+        return self.user_items.nbytes() + self.item_users.nbytes()
+
+
+def co_occurrence_index(index, n_cols, topk=0, block_rows=8192):
+    r"""2-hop neighbors of every row of ``index``: the rows sharing at least one column with it, itself excluded.
+
+    Computed as the sparse product ``A @ A.T`` in blocks of ``block_rows`` rows, so at most one block of the
+    product is held besides the result.
+
+    Args:
+        index (CSRIndex): rows -> columns, e.g. users -> items
+        n_cols (int): number of columns of ``index``
+        topk (int): if > 0, keep only the ``topk`` neighbors sharing the most columns per row
+            (ties broken by id)
+        block_rows (int): rows multiplied at a time
+
+    Returns:
+        CSRIndex: rows -> co-occurring rows
+    """
+    mat = sp.csr_matrix((np.ones(index.nnz, dtype=np.float32), index.indices, index.indptr),
+                        shape=(index.n_rows, n_cols))
+    mat_t = mat.T.tocsr()
+    rows, cols = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for start in range(0, index.n_rows, block_rows):
+        blk = (mat[start: start + block_rows] @ mat_t).tocoo()
+        r, c, d = blk.row.astype(np.int64) + start, blk.col.astype(np.int64), blk.data
+        keep = r != c
+        r, c, d = r[keep], c[keep], d[keep]
+        if topk > 0:
+            order = np.lexsort((c, -d, r))
+            r, c = r[order], c[order]
+            rank = np.arange(len(r)) - np.searchsorted(r, r, side='left')
+            r, c = r[rank < topk], c[rank < topk]
+        rows.append(r)
+        cols.append(c)
+    return CSRIndex(np.concatenate(rows), np.concatenate(cols), index.n_rows)
@@ -16,7 +16,7 @@ import platform
 import os
 import torch
 
-def save_modality_gate(model, config):
+def save_modality_gate(model, config, item_perm=None):
     if not hasattr(model, "modality_gate"):
         print("Model has no modality_gate. Skipping.")
         return
@@ -27,13 +27,16 @@ def save_modality_gate(model, config):
 
     model.eval()
     with torch.no_grad():
-        t_proj = model.text_trs(model.text_embedding.weight)
-        v_proj = model.image_trs(model.image_embedding.weight)
+        t_proj = model.text_trs(model.text_embedding.weight.float())
+        v_proj = model.image_trs(model.image_embedding.weight.float())
 
         gate_input = torch.cat([t_proj, v_proj], dim=-1)
         alpha = torch.softmax(model.modality_gate(gate_input), dim=-1)
 
         alpha = alpha.cpu().numpy()
+        # back to the original item order when items were relabeled
+        if item_perm is not None:
+            alpha[item_perm] = alpha.copy()
 
     # directory
     out_dir = os.path.join(os.getcwd(), "modality_gate_outputs")
@@ -127,15 +130,18 @@ def quick_start(model, dataset, config_dict, save_model=True):
         # trainer loading and initialization
         trainer = get_trainer()(config, model)
         if config['retrieve_mgod'] and config['load_model']:
-            save_modality_gate(model, config)
+            save_modality_gate(model, config, train_dataset.item_perm)
         if config['inference_only']:
             test_result = trainer.evaluate(test_data, is_test=True, idx=idx)
             logger.info('inference-only test result: {}'.format(dict2str(test_result)))
+            model.close()
             return
         # model training
         best_valid_score, best_valid_result, best_test_upon_valid = trainer.fit(train_data, valid_data=valid_data, test_data=test_data, saved=save_model)
         #########
         hyper_ret.append((hyper_tuple, best_valid_result, best_test_upon_valid))
+        # every grid point builds a new model: stop the previous one's propagation workers
+        model.close()
 
         # save best test
         if best_test_upon_valid[val_metric] > best_test_value:
@@ -0,0 +1,52 @@
+# coding: utf-8
+"""
+Locality-improving relabeling of the user-item graph
+################################################
+"""
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+
+
+REORDER_METHODS = ('degree', 'rcm')
+
+
+def node_order(users, items, n_users, n_items, method='degree'):
+    r"""New order of the users and items of an interaction graph.
+
+    ``degree`` sorts users and items by descending degree (ties keep their id order), packing the frequently
+    touched rows of the embedding tables together. ``rcm`` runs reverse Cuthill-McKee over the symmetric bipartite
+    graph, which keeps the neighbors of every node close in id, and splits the joint order into users and items.
+
+    Args:
+        users (np.ndarray): user id of every interaction
+        items (np.ndarray): item id of every interaction
+        n_users (int): number of users
+        n_items (int): number of items
+        method (str): one of :data:`REORDER_METHODS`
+
+    Returns:
+        (np.ndarray, np.ndarray): int64 ``user_perm`` and ``item_perm``, the old id of every new id.
+    """
+    users = np.asarray(users, dtype=np.int64)
+    items = np.asarray(items, dtype=np.int64)
+    if method == 'degree':
+        user_perm = np.argsort(-np.bincount(users, minlength=n_users), kind='stable')
+        item_perm = np.argsort(-np.bincount(items, minlength=n_items), kind='stable')
+        return user_perm.astype(np.int64), item_perm.astype(np.int64)
+    if method == 'rcm':
+        n_nodes = n_users + n_items
+        adj = sp.csr_matrix((np.ones(len(users), dtype=np.float32), (users, items + n_users)),
+                            shape=(n_nodes, n_nodes))
+        adj = (adj + adj.T).tocsr()
+        order = reverse_cuthill_mckee(adj, symmetric_mode=True).astype(np.int64)
+        return order[order < n_users], order[order >= n_users] - n_users
+    raise ValueError('node_reorder [{}] should be one of {}'.format(method, REORDER_METHODS))
+
+
+def inverse_permutation(perm):
+    r"""``rank`` with ``rank[perm[k]] == k``: the new id of every old id.
+    """
+    rank = np.empty_like(perm)
+    rank[perm] = np.arange(len(perm), dtype=perm.dtype)
+    return rank
@@ -0,0 +1,90 @@
+# coding: utf-8
+"""
+Vectorized samplers for training dataloaders
+################################################
+"""
+import numpy as np
+
+
+class NegativeSampler(object):
+    r"""Draws negative items for a whole batch of users at once.
+
+    Membership of all (user, candidate) pairs in the training history is tested at once against the
+    user->items :class:`~utils.history_index.CSRIndex`. Candidates that hit the history are resampled,
+    only those, until none is left.
+
+    Args:
+        user_items (CSRIndex): training history, users -> sorted items
+        candidates (np.ndarray): items to draw from
+        seed (int, optional): seed of the sampler's own random stream
+    """
+    def __init__(self, user_items, candidates, seed=None):
+        self.user_items = user_items
+        self.candidates = np.asarray(candidates)
+        self.rng = np.random.default_rng(seed)
+
+    def seed(self, seed):
+        self.rng = np.random.default_rng(seed)
+
+    def contains(self, users, items):
+        """Boolean mask, whether each (users[k], items[k]) is a training interaction.
+        """
+        return self.user_items.contains(users, items)
+
+    def sample(self, users, num=1):
+        """Sample ``num`` negatives for every user.
+
+        Returns:
+            np.ndarray: (num, len(users)) int64 item ids, row ``j`` holds the ``j``-th negative of each user.
+        """
+        users = np.tile(np.asarray(users, dtype=np.int64), num)
+        neg = self.candidates[self.rng.integers(0, len(self.candidates), size=len(users))].astype(np.int64)
+        todo = np.flatnonzero(self.contains(users, neg))
+        while len(todo):
+            neg[todo] = self.candidates[self.rng.integers(0, len(self.candidates), size=len(todo))]
+            todo = todo[self.contains(users[todo], neg[todo])]
+        return neg.reshape(num, -1)
+
+
+class NeighborhoodSampler(object):
+    r"""Draws one positive and one negative neighbor for a whole batch of ids at once.
+
+    The positive is uniform over the id's co-occurrence neighbors, the negative uniform over ``candidates`` and
+    not a neighbor. Ids without neighbors, or whose neighbors cover more than ``max_ratio`` of the candidates,
+    get 0 for both.
+
+    Args:
+        neighbors (CSRIndex): ids -> co-occurring ids
+        candidates (np.ndarray): ids to draw negatives from
+        max_ratio (float): skip ids whose neighbors are more than this share of the candidates
+        seed (int, optional): seed of the sampler's own random stream
+    """
+    def __init__(self, neighbors, candidates, max_ratio=0.8, seed=None):
+        self.neighbors = neighbors
+        self.candidates = np.asarray(candidates)
+        self.max_ratio = max_ratio
+        self.rng = np.random.default_rng(seed)
+
+    def seed(self, seed):
+        self.rng = np.random.default_rng(seed)
+
+    def sample(self, ids):
+        """
+        Returns:
+            (np.ndarray, np.ndarray): int64 positive and negative neighbor of every id.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        pos = np.zeros(len(ids), dtype=np.int64)
+        neg = np.zeros(len(ids), dtype=np.int64)
+        deg = self.neighbors.degree(ids)
+        valid = np.flatnonzero((deg > 0) & (deg / len(self.candidates) <= self.max_ratio))
+        ids, deg = ids[valid], deg[valid]
+        offset = self.neighbors.indptr[ids] + (self.rng.random(len(ids)) * deg).astype(np.int64)
+        pos[valid] = self.neighbors.indices[offset]
+        neg_v = self.candidates[self.rng.integers(0, len(self.candidates), size=len(ids))].astype(np.int64)
+        todo = np.flatnonzero(self.neighbors.contains(ids, neg_v))
+        while len(todo):
+            neg_v[todo] = self.candidates[self.rng.integers(0, len(self.candidates), size=len(todo))]
+            todo = todo[self.neighbors.contains(ids[todo], neg_v[todo])]
+        neg[valid] = neg_v
+        return pos, neg
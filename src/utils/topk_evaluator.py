@@ -80,8 +80,9 @@ class TopKEvaluator(object):
                 os.makedirs(dir_name)
             file_path = os.path.join(dir_name, '{}-{}-idx{}-top{}-{}.csv'.format(
                 model_name, dataset_name, idx, max_k, get_local_time()))
-            x_df = pd.DataFrame(topk_index)
-            x_df.insert(0, 'id', eval_data.get_eval_users())
+            # saved with the original ids when nodes were relabeled
+            x_df = pd.DataFrame(eval_data.dataset.original_item_ids(topk_index))
+            x_df.insert(0, 'id', eval_data.dataset.original_user_ids(eval_data.get_eval_users()))
             x_df.columns = ['id']+['top_'+str(i) for i in range(max_k)]
             x_df = x_df.astype(int)
             x_df.to_csv(file_path, sep='\t', index=False)
@@ -6,6 +6,8 @@ Utility functions
 ##########################
 """
 
+import os
+import resource
 import numpy as np
 import torch
 import importlib
@@ -25,6 +27,21 @@ def get_local_time():
     return cur
 
 
+def get_memory_usage():
+    r"""Get resident memory of the current process
+
+    Returns:
+        tuple: (current rss, peak rss) in MB. Current rss is only available on Linux, else it is the peak.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            cur = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024.0 ** 2
+    except (OSError, ValueError, IndexError):
+        cur = peak
+    return cur, peak
+
+
 def get_model(model_name):
     r"""Automatically select model class based on model name
     Args: